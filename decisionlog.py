@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: ErwanBCN,
+# Journal binaire des décisions VMC DF (1 enregistrement fixe par cycle) + lecteur mmap.
+# Module autonome (stdlib uniquement) : utilisable par le plugin ET hors Domoticz pour l'analyse.
+
+import mmap
+import os
+import struct
+from array import array
+
+# ----------------------------- Format -----------------------------
+
+LOG_MAGIC = b"VMCDFLOG"
+LOG_VERSION = 2  # v2 : + n_eval, pente RH par pièce (rejeu exact des règles)
+MAX_ROOMS = 8  # nb max de pièces humides enregistrées (au-delà : tronqué)
+
+# En-tête : magic(8s) version(H) max_rooms(H) record_size(I)
+HEADER = struct.Struct("<8sHHI")
+
+# Enregistrement : ts(d) mode(b) path(b) target(b) relay(b) n_rooms(B) n_eval(B) Td_ext(f) Td_target(f) Td_ref(f)
+#                  + RH[MAX_ROOMS](f) + Td[MAX_ROOMS](f) + ΔTd[MAX_ROOMS](f) + pente RH[MAX_ROOMS](f)
+# n_eval : nb de pièces (les n_eval premières) réellement évaluées par les règles pour ce cycle
+RECORD = struct.Struct(f"<dbbbbBB3f{MAX_ROOMS}f{MAX_ROOMS}f{MAX_ROOMS}f{MAX_ROOMS}f")
+
+SCALAR_FIELDS = ("ts", "mode", "path", "target", "relay", "n_rooms", "n_eval", "Td_ext", "Td_target", "Td_ref")
+ROOM_FIELDS = ("rh", "td", "gap", "slope")
+
+# Codes
+MODE_AUTO, MODE_TIMER, MODE_FORCED = 0, 1, 2
+MODE_CODES = {"Auto": MODE_AUTO, "Timer": MODE_TIMER, "Forced": MODE_FORCED}
+PATH_NODATA, PATH_FORCED, PATH_FALLBACK, PATH_DTD = 0, 1, 2, 3
+STATE_NONE = -1  # target/relay : HOLD ou inconnu
+
+_NAN = float("nan")
+
+
+def _f(x):
+    return _NAN if x is None else float(x)
+
+
+def _tri(x):
+    return STATE_NONE if x is None else (1 if x else 0)
+
+
+def _rooms(values):
+    vals = [_f(v) for v in (values or [])[:MAX_ROOMS]]
+    return vals + [_NAN] * (MAX_ROOMS - len(vals))
+
+
+def _empty_columns():
+    cols = {name: array("b" if name in ("mode", "path", "target", "relay") else "d") for name in SCALAR_FIELDS}
+    cols.update({name: [array("d") for _ in range(MAX_ROOMS)] for name in ROOM_FIELDS})
+    return cols
+
+
+def _header_ok(path):
+    """False si path existe avec un en-tête complet d'un autre format (magic, version, pièces, taille)."""
+    try:
+        with open(path, "rb") as fh:
+            raw = fh.read(HEADER.size)
+    except FileNotFoundError:
+        return True
+    if len(raw) < HEADER.size:
+        return True  # en-tête tronqué : réécrit par open()
+    return HEADER.unpack(raw) == (LOG_MAGIC, LOG_VERSION, MAX_ROOMS, RECORD.size)
+
+
+# ----------------------------- Writer -----------------------------
+
+class DecisionLog:
+    """Append-only writer, rotation par taille : path -> path.1 -> ... -> path.<backups>.
+    Défaut : 16 MiB/fichier ≈ 25 jours à 1 enregistrement / 20 s, x (1 + 6 backups) ≈ 6 mois."""
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backups=6):
+        self.path = path
+        self.max_bytes = max(HEADER.size + RECORD.size, int(max_bytes))
+        self.backups = max(0, int(backups))
+        self._fh = None
+        self._size = 0
+        self.set_aside = None  # chemin où un journal d'un autre format a été écarté (None sinon)
+
+    def open(self):
+        if self._fh is not None:
+            return
+        if not _header_ok(self.path):
+            # autre format/version : jamais complété, écarté hors de la chaîne de rotation
+            self.set_aside = f"{self.path}.bad"
+            os.replace(self.path, self.set_aside)
+        self._fh = open(self.path, "ab")
+        size = self._fh.tell()
+        if size < HEADER.size:
+            # fichier neuf (ou tronqué) : on repart d'un en-tête propre
+            self._fh.truncate(0)
+            self._fh.write(HEADER.pack(LOG_MAGIC, LOG_VERSION, MAX_ROOMS, RECORD.size))
+            size = HEADER.size
+        else:
+            # enregistrement partiel en fin (crash pendant l'écriture) : coupé, sinon tout ce qui suit serait décalé
+            whole = HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size
+            if whole != size:
+                self._fh.truncate(whole)
+                size = whole
+        self._size = size
+
+    def _rotate(self):
+        self.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def write(self, ts, mode, path, target, relay, Td_ext, Td_target, Td_ref, rh_list, td_list, gap_list,
+              slope_list=None, n_eval=None):
+        if self._fh is None:
+            self.open()
+        if self._size + RECORD.size > self.max_bytes:
+            self._rotate()
+            self.open()
+        n = min(len(rh_list or []), MAX_ROOMS)
+        n_eval = n if n_eval is None else min(int(n_eval), MAX_ROOMS)
+        rec = RECORD.pack(
+            float(ts), int(mode), int(path), _tri(target), _tri(relay), n, n_eval,
+            _f(Td_ext), _f(Td_target), _f(Td_ref),
+            *_rooms(rh_list), *_rooms(td_list), *_rooms(gap_list), *_rooms(slope_list),
+        )
+        self._fh.write(rec)
+        self._fh.flush()
+        self._size += RECORD.size
+
+    def close(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            finally:
+                self._fh = None
+
+
+# ----------------------------- Reader -----------------------------
+
+class DecisionLogReader:
+    """Lecture mmap d'un journal : len(), records[i] / [a:b], colonnes en array('d'/'b')."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "rb")
+        size = os.fstat(self._fh.fileno()).st_size
+        if size < HEADER.size:
+            self._fh.close()
+            raise ValueError(f"{path}: not a VMCDF decision log (too short)")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, max_rooms, rec_size = HEADER.unpack_from(self._mm, 0)
+        if magic != LOG_MAGIC or version != LOG_VERSION or max_rooms != MAX_ROOMS or rec_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path}: unsupported decision log header")
+        # un enregistrement partiel en fin (crash pendant l'écriture) est ignoré ici, coupé par DecisionLog.open()
+        self._count = (size - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _bounds(self, start, stop):
+        return range(self._count)[slice(start, stop)]
+
+    def _body(self, start, stop):
+        r = self._bounds(start, stop)
+        a = HEADER.size + r.start * RECORD.size
+        b = HEADER.size + r.stop * RECORD.size
+        return memoryview(self._mm)[a:b]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if i.step not in (None, 1):
+                raise ValueError("step slicing not supported")
+            with self._body(i.start, i.stop) as body:
+                return list(RECORD.iter_unpack(body))
+        i = self._bounds(None, None)[i]
+        return RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+
+    def columns(self, start=None, stop=None):
+        """Return {field: array} ; champs par pièce en listes de MAX_ROOMS arrays ('rh', 'td', 'gap', 'slope')."""
+        cols = _empty_columns()
+        scal = [cols[name] for name in SCALAR_FIELDS]
+        per_room = [col for name in ROOM_FIELDS for col in cols[name]]
+        ns = len(SCALAR_FIELDS)
+        with self._body(start, stop) as body:
+            for rec in RECORD.iter_unpack(body):
+                for col, v in zip(scal, rec[:ns]):
+                    col.append(v)
+                for col, v in zip(per_room, rec[ns:]):
+                    col.append(v)
+        return cols
+
+    def to_numpy(self):
+        """Vue numpy structurée sans copie (numpy optionnel)."""
+        import numpy as np
+        dtype = np.dtype([
+            ("ts", "<f8"), ("mode", "i1"), ("path", "i1"), ("target", "i1"), ("relay", "i1"), ("n_rooms", "u1"),
+            ("n_eval", "u1"), ("Td_ext", "<f4"), ("Td_target", "<f4"), ("Td_ref", "<f4"),
+            ("rh", "<f4", (MAX_ROOMS,)), ("td", "<f4", (MAX_ROOMS,)), ("gap", "<f4", (MAX_ROOMS,)),
+            ("slope", "<f4", (MAX_ROOMS,)),
+        ])
+        return np.frombuffer(self._mm, dtype=dtype, count=self._count, offset=HEADER.size)
+
+
+class DecisionLogChain:
+    """Lecture des fichiers en rotation comme un seul journal, du plus ancien (path.N) au plus récent (path)."""
+
+    def __init__(self, path):
+        self.path = path
+        files = []
+        i = 1
+        while os.path.exists(f"{path}.{i}"):
+            files.append(f"{path}.{i}")
+            i += 1
+        files.reverse()
+        if os.path.exists(path):
+            files.append(path)
+        self.readers = []
+        try:
+            for f in files:
+                self.readers.append(DecisionLogReader(f))
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return sum(len(r) for r in self.readers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for r in self.readers:
+            r.close()
+        self.readers = []
+
+    def _parts(self, start, stop):
+        """(reader, start, stop) locaux couvrant la plage globale [start:stop]."""
+        r = range(len(self))[slice(start, stop)]
+        a, b, base = r.start, r.stop, 0
+        for reader in self.readers:
+            n = len(reader)
+            lo, hi = max(a - base, 0), min(b - base, n)
+            if lo < hi:
+                yield reader, lo, hi
+            base += n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if i.step not in (None, 1):
+                raise ValueError("step slicing not supported")
+            out = []
+            for reader, lo, hi in self._parts(i.start, i.stop):
+                out.extend(reader[lo:hi])
+            return out
+        i = range(len(self))[i]
+        for reader in self.readers:
+            if i < len(reader):
+                return reader[i]
+            i -= len(reader)
+
+    def columns(self, start=None, stop=None):
+        """Comme DecisionLogReader.columns(), concaténé sur tous les fichiers."""
+        cols = None
+        for reader, lo, hi in self._parts(start, stop):
+            part = reader.columns(lo, hi)
+            if cols is None:
+                cols = part
+                continue
+            for name in SCALAR_FIELDS:
+                cols[name].extend(part[name])
+            for name in ROOM_FIELDS:
+                for col, more in zip(cols[name], part[name]):
+                    col.extend(more)
+        return cols if cols is not None else _empty_columns()
@@ -8,13 +8,20 @@
 # Version:    1.0.2: first valid...
 # Version:    1.0.3: Logique unifiée ΔTd + High/Low (réf = moyenne Td_ext/Td_int_normale) ...
 # Version:    1.0.4: optim update devices ...
+# Version:    1.0.5: journal binaire des décisions (decisionlog.py) ...
+# Version:    1.0.6: budget par cycle, stages cosmétiques différés ...
+# Version:    1.0.7: groupes de relais (CSV d'idx / groupe Domoticz) ...
+# Version:    1.0.8: trace structurée paresseuse + dump (Device 7) ...
+# Version:    1.0.9: cadence de lecture par groupe de sondes ...
+# Version:    1.1.0: moteur de règles ON/OFF compilé (rules.py, vmcdf_rules.conf) ...
+# Version:    1.1.1: découverte des sondes par plans Domoticz + index des formats ...
 
 
 
 """
-<plugin key="ZZ-VMCDF" name="RONELABS - VMC DF Control" author="ErwanBCN" version="1.0.4" externallink="https://ronelabs.com">
+<plugin key="ZZ-VMCDF" name="RONELABS - VMC DF Control" author="ErwanBCN" version="1.1.1" externallink="https://ronelabs.com">
     <description>
-        <h2>VMC DF Control V1.0.4</h2><br/>
+        <h2>VMC DF Control V1.1.1</h2><br/>
         Easily implement in Domoticz a VMC DF Inteliggent Control<br/>
         <h3>Set-up and Configuration</h3>
     </description>
@@ -22,7 +29,8 @@
         <param field="Username" label="Outdoor Temp/Hum sensors (CSV List of idx)" width="400px" required="true" default=""/>
         <param field="Password" label="Normal rooms Temp/Hum sensors (CSV List of idx)" width="400px" required="true" default=""/>
         <param field="Mode1" label="Wet rooms Temp/Hum sensors (CSV List of idx)" width="400px" required="true" default=""/>
-        <param field="Mode3" label="Boost relay (CSV List of idx)" width="50px" required="true" default=""/>
+        <param field="Mode3" label="Boost relays (CSV List of idx, G&lt;idx&gt; = group)" width="200px" required="true" default=""/>
+        <param field="Mode2" label="Advanced : Cycle budget(s),Poll outdoor(s),Poll normal(s),Poll wet(s),Room plans discovery(0/1),Trace dump(cycles)" width="200px" required="false" default="10,300,120,0,0,10"/>
         <param field="Mode4" label="Presence sensors (CSV List of idx)" width="400px" required="false" default=""/>
         <param field="Mode5" label="Params(expert) : Timer(Mins),RH↓,RH↑,ΔTd-DRY,ΔTd-ON,ΔTd-OFF " width="400px" required="true" default="60,55,75,20,10,5"/>
         <param field="Mode6" label="Logging Level" width="200px">
@@ -39,12 +47,17 @@
 # ----------------------------- Imports -----------------------------
 import json
 import urllib
+import urllib.error
 import urllib.parse as parse
 import urllib.request as request
 from datetime import datetime, timedelta
 import time
 import math
+import collections
+import os
 import Domoticz
+import decisionlog
+import rules
 
 try:
     from Domoticz import Devices, Parameters
@@ -61,6 +74,99 @@ class deviceparam:
         self.nvalue = nvalue
         self.svalue = svalue
 
+class StageScheduler:
+    """Budget temps par cycle : un stage n'est lancé que s'il tient dans le temps restant (coût estimé),
+    sinon il est reporté. Un stage reporté max_defer fois de suite est forcé (données jamais trop vieilles)."""
+
+    def __init__(self, budget=10.0, max_defer=3):
+        self.budget = float(budget)
+        self.max_defer = max_defer
+        self.cost = {}      # stage -> durée estimée (s), moyenne glissante
+        self.skipped = {}   # stage -> nb de reports consécutifs
+        self._t0 = time.monotonic()
+        self._deferred = []
+
+    def start(self):
+        self._t0 = time.monotonic()
+        self._deferred = []
+
+    def elapsed(self):
+        return time.monotonic() - self._t0
+
+    def remaining(self):
+        return self.budget - self.elapsed()
+
+    def run(self, name, fn):
+        est = self.cost.get(name, 0.0)
+        if self.elapsed() + est > self.budget and self.skipped.get(name, 0) < self.max_defer:
+            self.skipped[name] = self.skipped.get(name, 0) + 1
+            self._deferred.append(name)
+            return False
+        t = time.monotonic()
+        try:
+            fn()
+        finally:
+            dt = time.monotonic() - t
+            self.cost[name] = dt if name not in self.cost else 0.7 * self.cost[name] + 0.3 * dt
+            self.skipped[name] = 0
+        return True
+
+    def finish(self):
+        """Retourne la liste des stages reportés pendant ce cycle."""
+        return list(self._deferred)
+
+class Tracer:
+    """Trace structurée et paresseuse : évènements (stage, idx, valeurs) bruts gardés dans un buffer borné
+    aux N derniers cycles ; formatés seulement si un sink est actif (Debug) ou lors d'un dump."""
+
+    DEBUG_PREFIX = "--------------DEBUG : "
+    SIGNED_FIELDS = ("dTd_gaps",)  # valeurs affichées avec signe (+.1f)
+
+    def __init__(self, cycles=50):
+        self.cycles = collections.deque(maxlen=cycles)  # (n°, ts, origine, [évènements])
+        self.count = 0
+        self.sink = None  # ex. Domoticz.Debug
+        self._events = []
+
+    def new_cycle(self, origin="heartbeat"):
+        self.count += 1
+        self._events = []
+        self.cycles.append((self.count, time.time(), origin, self._events))
+        if self.sink:
+            self.sink(f"{self.DEBUG_PREFIX}cycle #{self.count} ({origin})")
+
+    def event(self, stage, idx=None, **values):
+        self._events.append((stage, idx, values))
+        if self.sink:
+            self.sink(self.DEBUG_PREFIX + self.format_event(stage, idx, values))
+
+    @staticmethod
+    def format_value(v, fmt=".1f"):
+        if v is None:
+            return "-"
+        if isinstance(v, bool):
+            return "ON" if v else "OFF"
+        if isinstance(v, float):
+            return format(v, fmt)
+        if isinstance(v, (list, tuple)):
+            return "[" + ", ".join(Tracer.format_value(x, fmt) for x in v) + "]"
+        return str(v)
+
+    @staticmethod
+    def format_event(stage, idx, values):
+        """Corps d'un évènement (sans préfixe Debug)."""
+        head = f"{stage}" + (f" idx={idx}" if idx is not None else "")
+        return head + "".join(
+            f" | {k}= {Tracer.format_value(v, '+.1f' if k in Tracer.SIGNED_FIELDS else '.1f')}"
+            for k, v in values.items())
+
+    def dump(self, n, out):
+        """Formate et envoie vers out() les n derniers cycles."""
+        for num, ts, origin, events in list(self.cycles)[-n:]:
+            out(f"TRACE cycle #{num} {datetime.fromtimestamp(ts):%Y-%m-%d %H:%M:%S} ({origin})")
+            for stage, idx, values in events:
+                out("TRACE   " + self.format_event(stage, idx, values))
+
 class BasePlugin:
     def __init__(self):
         self.debug = False
@@ -71,7 +177,13 @@ class BasePlugin:
         self.outdoor_idxs = []
         self.indoor_idxs = []
         self.hum_idxs = []
-        self.relay_idx = None
+        self.relay_idxs = []
+        self.relay_group = None
+        self.relay_group_members = None  # membres du groupe Domoticz (None : pas encore lus)
+        self.relay_state = {}  # idx -> 'On'/'Off'/None (dernier état lu ou commandé)
+        # états relais relus tous les N appels (ou si inconnus / après un échec), sinon état suivi
+        self.relay_check_cycles = 15
+        self._relay_check_in = 0
         #self._last_td_gate = None
         self.Timer = 60
         self.TimerStartedTime = now
@@ -91,10 +203,58 @@ class BasePlugin:
         # OPTIM: cache des lectures API pendant un cycle refresh/heartbeat
         self._cycle_device_cache = {}
 
+        # OPTIM: cadence de lecture par groupe de sondes (s) ; entre 2 lectures, les relevés en cache
+        # et Td_ext/Td_target dérivés sont réutilisés (pièces humides : chaque heartbeat)
+        self.poll_intervals = {"outdoor": 300.0, "normal": 120.0, "wet": 0.0}
+        self._polled_at = {}     # groupe -> time.monotonic() de la dernière lecture
+        self._group_of = {}      # idx -> groupe
+        self._ref_pending = True  # Td_ext/Td_target à recalculer
+        self._rh_prev = {}        # idx -> (time.monotonic(), RH, pente) du dernier relevé réellement lu
+        self._fetched = set()     # idx lus par l'API pendant ce cycle (hors cache)
+
+        # Index des sondes : idx -> (rôle, type, parser) ; plus aucun sondage de format par cycle
+        self.device_index = {}
+        self.discovery = False
+        self.discovery_interval = 600.0  # s entre 2 vérifications des plans (getplans)
+        self._discovery_at = None
+        self._plan_signature = None
+
+        # Règles ON/OFF compilées (rules.py) : <HomeFolder>/vmcdf_rules.conf sinon règles par défaut
+        self.rules = rules.RuleSet(High=self.high_th, Low=self.low_th, td_on=self._td_on,
+                                   td_off=self._td_off, td_eps=self._td_eps)
+
+        # Journal binaire des décisions (1 enregistrement / cycle)
+        self.decision_log = None
+
+        # Budget par cycle : chemin critique d'abord, stages cosmétiques reportés si dépassement
+        self.scheduler = StageScheduler(budget=10.0)
+        self._last_deferred = []
+        # chemin critique borné : timeouts API tirés du budget restant, lectures sautées si épuisé
+        self._critical = False
+        self._skipped_reads = []
+        self._last_skipped = []
+        self._info_txt = None
+
+        # Trace structurée des décisions (formatée seulement si Debug actif ou dump via Device 7)
+        self.trace = Tracer(cycles=50)
+        self.trace_dump_cycles = 10  # cycles envoyés au log par Device 7 (Mode2, au plus les 50 gardés)
+
     # -------------- Life cycle --------------
 
     def _start_refresh_cycle(self):
-        self._cycle_device_cache = {}
+        now = time.monotonic()
+        due = set()
+        for group, interval in self.poll_intervals.items():
+            last = self._polled_at.get(group)
+            if last is None or now - last >= interval:
+                due.add(group)
+                self._polled_at[group] = now
+        if due & {"outdoor", "normal"}:
+            self._ref_pending = True
+        self._fetched = set()
+        # on garde les relevés valides des groupes pas encore à relire (les échecs None sont relus)
+        self._cycle_device_cache = {idx: dev for idx, dev in self._cycle_device_cache.items()
+                                    if dev and self._group_of.get(idx) not in due and idx in self._group_of}
 
     def updateDeviceIfChanged(self, unit, nValue, sValue):
         if unit not in Devices:
@@ -115,10 +275,12 @@ class BasePlugin:
             self.loglevel = Parameters["Mode6"]
         if debuglevel != 0:
             self.debug = True
+            self.trace.sink = Domoticz.Debug
             Domoticz.Debugging(debuglevel)
             DumpConfigToLog()
         else:
             self.debug = False
+            self.trace.sink = None
             Domoticz.Debugging(0)
 
         # Paramètres
@@ -126,10 +288,11 @@ class BasePlugin:
         self.indoor_idxs = parseCSV_to_ints(Parameters.get("Password", ""))
         self.hum_idxs = parseCSV_to_ints(Parameters.get("Mode1", ""))
 
-        try:
-            self.relay_idx = int(float(Parameters.get("Mode3", 0))) or None
-        except Exception:
-            self.relay_idx = None
+        # Relais : CSV d'idx, 'G<idx>' = groupe Domoticz (1 appel pour commuter tous les relais)
+        self.relay_idxs, self.relay_group = parse_relay_param(Parameters.get("Mode3", ""))
+        self.relay_state = {idx: None for idx in self.relay_idxs}
+        self.setup_relay_group()
+        if not self.relay_idxs:
             Domoticz.Error("NO Boost Relay in idx parameters")
 
         # splits experts parameters
@@ -148,11 +311,41 @@ class BasePlugin:
         else:
             Domoticz.Error("Error reading Experts (MODE 5) parameters")
 
+        # Paramètres avancés : budget de cycle (s), cadences de lecture outdoor/normal/wet (s), découverte,
+        # taille du dump de trace (cycles)
+        # lecture par position : un champ vide ou invalide garde sa valeur par défaut sans décaler les suivants
+        raw = Parameters.get("Mode2", "")
+        adv = parseCSV_positional_floats(raw, 6)
+        # budget et dump > 0, cadences >= 0, découverte 0/1 ; les autres valeurs sont écartées
+        adv = [v if v is not None and (v > 0 if i in (0, 5) else v >= 0) else None for i, v in enumerate(adv)]
+        if adv[0] is not None:
+            self.scheduler.budget = adv[0]
+        for group, val in zip(("outdoor", "normal", "wet"), adv[1:4]):
+            if val is not None:
+                self.poll_intervals[group] = val
+        if adv[5] is not None:
+            self.trace_dump_cycles = min(int(adv[5]) or 1, self.trace.cycles.maxlen)
+        fields = [x.strip() for x in raw.split(',')][:6]
+        bad = [i + 1 for i, x in enumerate(fields) if x and adv[i] is None]
+        if bad:
+            Domoticz.Error(f"Error reading Advanced (MODE 2) parameters — field(s) {bad} invalid, defaults used")
+
+        self.build_groups()
+
+        # Mode découverte : rôles des sondes d'après les plans Domoticz (remplace les listes d'idx)
+        self.discovery = adv[4] is not None and adv[4] > 0
+        if self.discovery:
+            self.discover_sensors(force=True)
+            self._discovery_at = time.monotonic()
+
         # Sanity: swap si inversés
         if self.low_th > self.high_th:
             Domoticz.Error(f"Inverted thresholds detected (low {self.low_th} > high {self.high_th}) — inversion.")
             self.low_th, self.high_th = self.high_th, self.low_th
 
+        # Règles de régulation compilées une fois (constantes Mode5 figées dans le code généré)
+        self.rules = self.load_rules(os.path.join(Parameters.get("HomeFolder", ""), "vmcdf_rules.conf"))
+
         # Créer les devices enfants (re-numérotés)
         created = []
         if 1 not in Devices:
@@ -177,6 +370,9 @@ class BasePlugin:
         if 6 not in Devices:
             Domoticz.Device(Unit=6, Name="Avg Outdoor", Type=82, Subtype=1, Used=1).Create()
             created.append(6)
+        if 7 not in Devices:
+            Domoticz.Device(Unit=7, Name="Trace dump", Type=244, Subtype=73, Switchtype=9, Used=1).Create()
+            created.append(7)
 
         for u in created:
             if u in Devices:
@@ -190,19 +386,37 @@ class BasePlugin:
         if 3 in Devices and Devices[3].sValue not in ("10", "20", "30"):
             self.updateDeviceIfChanged(3, 1, "10")
 
+        # Journal binaire des décisions : <HomeFolder>/vmcdf_decisions.bin (+ .1 .. .6 en rotation, ~6 mois)
+        try:
+            self.decision_log = decisionlog.DecisionLog(
+                os.path.join(Parameters.get("HomeFolder", ""), "vmcdf_decisions.bin"))
+            self.decision_log.open()
+            if self.decision_log.set_aside:
+                Domoticz.Log(f"Decision log: incompatible file moved to {self.decision_log.set_aside}, new log started")
+        except OSError as e:
+            self.decision_log = None
+            Domoticz.Error(f"Decision log disabled: {e}")
+
         # Set domoticz heartbeat to x s between 5 to 20 max
         Domoticz.Heartbeat(20)
 
         # Lecture initiale + maj état
+        self.trace.new_cycle("start")
         self.refresh_and_act()
 
     def onStop(self):
         Domoticz.Log("onStop called")
+        if self.decision_log is not None:
+            self.decision_log.close()
         Domoticz.Debugging(0)
 
     def onCommand(self, Unit, Command, Level, Color):
         Domoticz.Log(f"VMC-DF: onCommand Unit={Unit} Command={Command} Level={Level}")
 
+        if Unit == 7:  # bouton poussoir : dump des derniers cycles dans le log Domoticz
+            self.trace.dump(self.trace_dump_cycles, Domoticz.Log)
+            return
+
         if Unit != 3:
             return
 
@@ -243,18 +457,18 @@ class BasePlugin:
             self.updateDeviceIfChanged(3, 1, "10")
 
         # Appliquer immédiatement
+        self.trace.new_cycle("command")
         self.apply_control()
+        self.update_info_device()
 
     def onHeartbeat(self):
-        if self.debug:
-            Domoticz.Debug("--------------DEBUG : onHeartbeat called")
-
+        self.trace.new_cycle()
         now = datetime.now()
 
         if self.TimerOn :
             mins, left = self._timer_remaining(now)
-            if self.debug and left:
-                Domoticz.Debug(f"--------------DEBUG : Timer remaining = {left}")
+            if left:
+                self.trace.event("timer", remaining=left)
             if self.TimerStartedTime  + timedelta(minutes=self.Timer) <= now :
                 self.force_mode = False
                 self.TimerOn = False
@@ -268,114 +482,86 @@ class BasePlugin:
     # -------------- Main Logic --------------
     def refresh_and_act(self):
         self._start_refresh_cycle()
+        self.scheduler.start()
+        self._skipped_reads = []
+
+        # --- Chemin critique : lectures pièces humides -> références Td -> régulation -> relais
+        # borné par le budget : chaque appel API prend le temps restant comme timeout (voir read_timeout)
+        self._critical = True
+        try:
+            self.read_wet_rooms()
+            # références ext/int : différables (on garde les dernières valeurs) mais jamais plus de max_defer cycles
+            self.scheduler.run("reference", self.read_reference)
+            self.read_wet_td()
+            self.apply_control()
+        finally:
+            self._critical = False
+        self.report_critical_path(self.scheduler.elapsed())
+
+        # --- Cosmétique : devices d'affichage, dans le budget restant sinon reporté au heartbeat suivant
+        self.scheduler.run("dev1_wet", self.update_wet_device)
+        self.scheduler.run("dev4_normal", self.update_normal_device)
+        self.scheduler.run("dev5_indoor", self.update_indoor_device)
+        self.scheduler.run("dev6_outdoor", self.update_outdoor_device)
+        self.scheduler.run("dev2_info", self.update_info_device)
+        if self.discovery:
+            self.scheduler.run("discovery", self.check_discovery)
+
+        deferred = self.scheduler.finish()
+        self.last_values["deferred"] = deferred
+        if deferred != self._last_deferred:
+            if deferred:
+                Domoticz.Log(f"Cycle budget {self.scheduler.budget:.1f}s exceeded "
+                             f"({self.scheduler.elapsed():.1f}s) — deferred: {', '.join(deferred)}")
+            elif self._last_deferred:
+                Domoticz.Log("Cycle budget OK — no deferred stage")
+            self._last_deferred = deferred
+
+    def report_critical_path(self, elapsed):
+        skipped = sorted(set(self._skipped_reads))
+        if elapsed > self.scheduler.budget or skipped:
+            self.trace.event("critical_path", elapsed=elapsed, budget=self.scheduler.budget, skipped=skipped or None)
+        if skipped != self._last_skipped:
+            if skipped:
+                Domoticz.Error(f"Cycle budget {self.scheduler.budget:.1f}s exhausted on critical path "
+                               f"({elapsed:.1f}s) — reads skipped (retried next cycle): idx {skipped}")
+            else:
+                Domoticz.Log("Critical path back within cycle budget")
+            self._last_skipped = skipped
+
+    # -------------- Budget API (chemin critique) --------------
+    def read_timeout(self):
+        """Timeout d'une lecture : budget restant moins la réserve des commandes relais ; None si épuisé."""
+        if not self._critical:
+            return API_TIMEOUT
+        left = self.scheduler.remaining() - self.scheduler.budget * RELAY_RESERVE
+        return min(API_TIMEOUT, left) if left >= API_MIN_TIMEOUT else None
+
+    def command_timeout(self):
+        """Timeout d'un appel relais : jamais sauté, borné par le budget restant (au moins API_MIN_TIMEOUT)."""
+        if not self._critical:
+            return API_TIMEOUT
+        return max(API_MIN_TIMEOUT, min(API_TIMEOUT, self.scheduler.remaining()))
+
+    # -------------- Stages (critiques) --------------
+    def read_wet_rooms(self):
         hum_vals = self.compute_hum_values()
         self.last_values['hum_list'] = hum_vals
-        avg_hum = sum(hum_vals) / len(hum_vals) if hum_vals else None
+        self.last_values['avg_hum'] = sum(hum_vals) / len(hum_vals) if hum_vals else None
 
-        # Initialise
+    def read_reference(self):
+        if not self._ref_pending:
+            return  # relevés outdoor/normal pas encore à relire : Td_ext/Td_target inchangés
         T_ext = RH_ext = T_int = RH_int = None
         try:
-            T_ext, RH_ext = avg_T_RH_from_idxs(self.outdoor_idxs, self.get_device_by_idx)
-            T_int, RH_int = avg_T_RH_from_idxs(self.indoor_idxs, self.get_device_by_idx)
+            T_ext, RH_ext = avg_T_RH_from_idxs(self.outdoor_idxs, self.read_TH)
+            T_int, RH_int = avg_T_RH_from_idxs(self.indoor_idxs, self.read_TH)
         except Exception:
             pass  # on garde None
 
-        # --- Update Device 1: Moyenne T et RH des pièces humides
-        T_wet, _ = avg_T_RH_from_idxs(self.hum_idxs, self.get_device_by_idx)
-
-        if 1 in Devices:
-            if (T_wet is not None) and (avg_hum is not None):
-                t_val = round(float(T_wet), 1)
-                h_val = int(round(float(avg_hum)))
-                status = self.get_hum_status(h_val)
-                self.updateDeviceIfChanged(1, 0, f"{t_val:.1f};{h_val};{status}")
-            else:
-                self.updateDeviceIfChanged(1, 0, "0;0;0")
-                if self.debug and ((T_wet is None) or (avg_hum is None)):
-                    Domoticz.Debug("--------------DEBUG : Device 1: valeurs manquantes -> 0;0;0")
-
-        # --- Update Device 4: Moyenne T et RH des des pièces normales ---
-        if 4 in Devices:
-            if (T_int is not None) and (RH_int is not None):
-                t_val = round(float(T_int), 1)
-                h_val = int(round(float(RH_int)))
-                status = self.get_hum_status(h_val)
-                self.updateDeviceIfChanged(4, 0, f"{t_val:.1f};{h_val};{status}")
-            else:
-                self.updateDeviceIfChanged(4, 0, "0;0;0")
-                if self.debug and ((T_int is None) or (RH_int is None)):
-                    Domoticz.Debug("--------------DEBUG : Device 4: valeurs manquantes -> 0;0;0")
-
-        # --- Update Device 5: Temp+Hum moyenne "ALL" (normal + wet) sans offsets ---
-        if 5 in Devices:
-            all_idxs = (self.indoor_idxs or []) + (self.hum_idxs or [])
-            Ts_all, RHs_all = [], []
-
-            for idx in all_idxs:
-                dev = self.get_device_by_idx(idx)
-                if not dev:
-                    continue
-
-                # Temp
-                t = None
-                if 'Temp' in dev:
-                    try:
-                        t = float(dev['Temp'])
-                    except Exception:
-                        t = None
-                elif 'Data' in dev and 'C' in str(dev['Data']):
-                    try:
-                        part = str(dev['Data']).split(',')[0]
-                        t = float(part.strip().split(' ')[0])
-                    except Exception:
-                        t = None
-                if t is not None:
-                    Ts_all.append(t)
-
-                # Humidité brute sans offset
-                h = None
-                if 'Humidity' in dev:
-                    try:
-                        h = float(dev['Humidity'])
-                    except Exception:
-                        h = None
-                elif 'Data' in dev and '%' in str(dev['Data']):
-                    try:
-                        part = str(dev['Data']).split(',')[1]
-                        h = float(part.strip().replace('%', '').strip())
-                    except Exception:
-                        h = None
-                if h is not None:
-                    h = max(0.0, min(100.0, h))
-                    RHs_all.append(h)
-
-        # --- Update Device 6: Avg Outdoor Temp+Hum ---
-        if 6 in Devices:
-            if (T_ext is not None) and (RH_ext is not None):
-                t_val = round(float(T_ext), 1)
-                h_val = int(round(float(RH_ext)))
-                status = self.get_hum_status(h_val)  # 0..3, réutilise ta fonction
-                self.updateDeviceIfChanged(6, 0, f"{t_val:.1f};{h_val};{status}")
-            else:
-                self.updateDeviceIfChanged(6, 0, "0;0;0")
-                if self.debug:
-                    Domoticz.Debug("--------------DEBUG : Outdoor: valeurs manquantes -> 0;0;0")
-
-        T_all = sum(Ts_all) / len(Ts_all) if Ts_all else None
-        RH_all = sum(RHs_all) / len(RHs_all) if RHs_all else None
-
-        if (T_all is not None) and (RH_all is not None):
-            t_val = round(float(T_all), 1)
-            h_val = int(round(float(RH_all)))
-            status = self.get_hum_status(h_val)
-            self.updateDeviceIfChanged(5, 0, f"{t_val:.1f};{h_val};{status}")
-
-        else:
-            self.updateDeviceIfChanged(5, 0, "0;0;0")
-            if self.debug:
-                Domoticz.Debug("--------------DEBUG : Device 5 ALL: valeurs manquantes -> 0;0;0")
-
-        # --- calculs pour logique
+        # une lecture en échec (None) est relue au cycle suivant : on reste en attente tant qu'il en manque une
+        failed = any(self._cycle_device_cache.get(idx, True) is None for idx in self.outdoor_idxs + self.indoor_idxs)
+        self._ref_pending = failed or None in (T_ext, RH_ext, T_int, RH_int)
 
         Td_ext = dew_point_celsius(T_ext, RH_ext) if (T_ext is not None and RH_ext is not None) else None
         Td_target = dew_point_celsius(T_int, RH_int) if (T_int is not None and RH_int is not None) else None
@@ -386,6 +572,7 @@ class BasePlugin:
             "Td_ext": Td_ext, "Td_target": Td_target,
         })
 
+    def read_wet_td(self):
         # ---Td pièces humides
         try:
             td_rooms = compute_room_td_list(self)
@@ -393,7 +580,57 @@ class BasePlugin:
             td_rooms = []
         self.last_values["td_rooms"] = td_rooms
 
-        self.apply_control()
+    # -------------- Stages (cosmétiques) --------------
+    def update_TH_device(self, unit, T, RH, label):
+        if unit not in Devices:
+            return
+        if (T is not None) and (RH is not None):
+            t_val = round(float(T), 1)
+            h_val = int(round(float(RH)))
+            status = self.get_hum_status(h_val)
+            self.updateDeviceIfChanged(unit, 0, f"{t_val:.1f};{h_val};{status}")
+        else:
+            self.updateDeviceIfChanged(unit, 0, "0;0;0")
+            self.trace.event("device", unit, missing=label)
+
+    def update_wet_device(self):
+        # --- Update Device 1: Moyenne T et RH des pièces humides
+        if 1 not in Devices:
+            return
+        T_wet, _ = avg_T_RH_from_idxs(self.hum_idxs, self.read_TH)
+        self.update_TH_device(1, T_wet, self.last_values.get('avg_hum'), "Wet")
+
+    def update_normal_device(self):
+        # --- Update Device 4: Moyenne T et RH des des pièces normales ---
+        self.update_TH_device(4, self.last_values.get("T_int"), self.last_values.get("RH_int"), "Normal")
+
+    def update_indoor_device(self):
+        # --- Update Device 5: Temp+Hum moyenne "ALL" (normal + wet) sans offsets ---
+        if 5 not in Devices:
+            return
+        all_idxs = (self.indoor_idxs or []) + (self.hum_idxs or [])
+        Ts_all, RHs_all = [], []
+
+        for idx in all_idxs:
+            t, h = self.read_TH(idx)
+            if t is not None:
+                Ts_all.append(t)
+            # Humidité brute sans offset
+            if h is not None:
+                RHs_all.append(max(0.0, min(100.0, h)))
+
+        T_all = sum(Ts_all) / len(Ts_all) if Ts_all else None
+        RH_all = sum(RHs_all) / len(RHs_all) if RHs_all else None
+        self.update_TH_device(5, T_all, RH_all, "ALL")
+
+    def update_outdoor_device(self):
+        # --- Update Device 6: Avg Outdoor Temp+Hum ---
+        self.update_TH_device(6, self.last_values.get("T_ext"), self.last_values.get("RH_ext"), "Outdoor")
+
+    def update_info_device(self):
+        # --- Update Device 2: texte d'état préparé par post_state
+        if 2 in Devices and self._info_txt is not None:
+            self.updateDeviceIfChanged(2, 0, self._info_txt)
 
     def apply_control(self):
         if self.TimerOn :
@@ -402,98 +639,108 @@ class BasePlugin:
             mode_label = "Forced" if self.force_mode else "Auto"
 
         target_on = False
+        hum_vals = self.last_values.get('hum_list') or []
+        Td_ext = self.last_values.get("Td_ext")
+        Td_intnor = self.last_values.get("Td_target")  # Td des pièces "normales" (T_int/RH_int)
+        td_rooms = self.last_values.get("td_rooms") or []
+        Td_ref = None
+        gaps = []
+        slopes = []
+        n_eval = 0  # pièces évaluées par les règles (journal : rejeu exact)
+
         if self.force_mode: # --- Mode forced ou Timer
             target_on = True
+            path = decisionlog.PATH_FORCED
         else: # --- Mode Auto
 
             # --- Logique unifiée ΔTd + High/Low (réf = moyenne Td_ext/Td_int_normale) ---
 
-            hum_vals = self.last_values.get('hum_list') or []
             if not hum_vals:
                 self.post_state(mode_label, None)
+                self.log_decision(mode_label, decisionlog.PATH_NODATA, None, None, Td_ref, hum_vals, td_rooms, gaps,
+                                  slopes, n_eval)
                 return
 
-            Td_ext = self.last_values.get("Td_ext")
-            Td_intnor = self.last_values.get("Td_target")  # Td des pièces "normales" (T_int/RH_int)
-            td_rooms = self.last_values.get("td_rooms") or []
-
             # Td_ref : moyenne des Td disponibles (ext + int normale)
             td_refs = [v for v in (Td_ext, Td_intnor) if v is not None]
             Td_ref = (sum(td_refs) / len(td_refs)) if td_refs else None
 
+            slopes = self.last_values.get("slope_list") or []
+
             # Fallback si pas de référence ΔTd
             if (Td_ref is None) or (not td_rooms):
-                if any(v >= self.high_th for v in hum_vals):
-                    target_on = True
-                elif all(v <= self.low_th for v in hum_vals):
-                    target_on = False
-                else:
-                    target_on = self.last_auto_state_on
+                path = decisionlog.PATH_FALLBACK
+                n_eval = len(hum_vals)
+                # règles [fallback] (défaut : ON si une pièce RH>=High, OFF si toutes RH<=Low)
+                on, off = self.rules.evaluate("fallback", hum_vals, Td=td_rooms, slope=slopes, Td_ext=Td_ext,
+                                              Td_int=Td_intnor, Td_ref=Td_ref)
+                target_on = self.rules.decide(on, off, self.last_auto_state_on)
 
-                if self.debug:
-                    try:
-                        lst_hum = ", ".join(f"{h:.1f}" for h in hum_vals) if hum_vals else "-"
-                        Domoticz.Debug(
-                            f"DEBUG: Fallback HR | High={self.high_th:.1f} Low={self.low_th:.1f} "
-                            f"| RH_rooms=[{lst_hum}] | Boost -> "
-                            f"{'↑ ON' if target_on else '↓ OFF' if target_on is False else '→ HOLD'}"
-                        )
-                    except Exception:
-                        pass
+                self.trace.event("fallback_RH", High=self.high_th, Low=self.low_th, RH_rooms=hum_vals, Boost=target_on)
 
             else:
+                path = decisionlog.PATH_DTD
                 td_on = getattr(self, "_td_on", 1.0)  # ex. 1.0 °C
                 td_off = getattr(self, "_td_off", 0.5)  # ex. 0.5 °C  (positif)
 
-                n = min(len(hum_vals), len(td_rooms))
+                n = n_eval = min(len(hum_vals), len(td_rooms))
 
                 # ΔTd par pièce humide vs Td_ref
                 gaps = [td_rooms[i] - Td_ref for i in range(n)]
 
-                # ON si au moins UNE pièce : RH>=High ET ΔTd>=td_on
-                any_on = any((hum_vals[i] >= self.high_th) and (gaps[i] >= td_on) for i in range(n))
+                # règles [dtd] compilées, toutes les pièces en une passe
+                # (défaut : ON si une pièce RH>=High ET ΔTd>=td_on, OFF si toutes ΔTd<=td_off OU RH<=Low)
+                on, off = self.rules.evaluate("dtd", hum_vals[:n], Td=td_rooms[:n], dTd=gaps, slope=slopes[:n],
+                                              Td_ext=Td_ext, Td_int=Td_intnor, Td_ref=Td_ref)
+                target_on = self.rules.decide(on, off, self.last_auto_state_on)
 
-                # OFF si TOUTES les pièces : (ΔTd<=td_off) OU ((ΔTd>=td_off) ET (RH<=Low))
-                all_off = all((gaps[i] <= td_off) or ((gaps[i] >= td_off) and (hum_vals[i] <= self.low_th))
-                              for i in range(n))
-
-                if any_on:
-                    target_on = True
-                elif all_off:
-                    target_on = False
-                else:
-                    target_on = self.last_auto_state_on
-
-                # DEBUG complet logique regul
-                if self.debug:
-                    try:
-                        lst_td = ", ".join(f"{v:.1f}" for v in td_rooms) if td_rooms else "-"
-                        lst_gap = ", ".join(f"{g:+.1f}" for g in gaps) if gaps else "-"
-                        lst_hum = ", ".join(f"{hum_vals[i]:.1f}" for i in range(n)) if n > 0 else "-"
-                        ref_txt = f"{Td_ref:.1f}°C"
-                        Domoticz.Debug(
-                            f"--------------DEBUG : Unified ΔTd | High= {self.high_th:.1f} Low= {self.low_th:.1f} "
-                            f"| ON@High & Δ≥ {td_on:+.1f} / OFF@All(Δ≤ {td_off:+.1f}  or  (Δ≥ {td_off:+.1f} & RH≤Low)) "
-                        )
-                        Domoticz.Debug(
-                            f"--------------DEBUG : Td_ref= {ref_txt} | Td_rooms= [{lst_td}] | ΔTd_gaps= [{lst_gap}] "
-                            f"| RH_rooms= [{lst_hum}] | Boost "
-                            f"{'↑ ON' if target_on else '↓ OFF' if target_on is False else '→ HOLD'}"
-                        )
-                    except Exception:
-                        pass
+                # trace complète logique regul (ON@High & Δ≥td_on / OFF@All(Δ≤td_off or (Δ≥td_off & RH≤Low)))
+                self.trace.event("unified_dTd", High=self.high_th, Low=self.low_th, td_on=td_on, td_off=td_off,
+                                 Td_ref=Td_ref, Td_rooms=td_rooms, dTd_gaps=gaps, RH_rooms=hum_vals[:n],
+                                 Boost=target_on)
 
         if self.force_mode is False:
             self.last_auto_state_on = target_on
 
         applied = self.switch_relay(target_on)
         self.post_state(mode_label, target_on if applied else None)
+        self.log_decision(mode_label, path, target_on, applied, Td_ref, hum_vals, td_rooms, gaps, slopes, n_eval)
+
+    # -------------- Rules --------------
+    def load_rules(self, path):
+        consts = dict(High=self.high_th, Low=self.low_th, td_on=self._td_on, td_off=self._td_off, td_eps=self._td_eps)
+        if os.path.isfile(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+                ruleset = rules.RuleSet(text, **consts)
+                Domoticz.Log(f"Control rules loaded from {path}")
+                return ruleset
+            except (OSError, rules.RuleError) as e:
+                Domoticz.Error(f"Control rules error ({path}): {e} — default rules used")
+        return rules.RuleSet(rules.DEFAULT_RULES, **consts)
+
+    # -------------- Decision log --------------
+    def log_decision(self, mode_label, path, target_on, applied, Td_ref, hum_vals, td_rooms, gaps, slopes, n_eval):
+        if self.decision_log is None:
+            return
+        try:
+            self.decision_log.write(
+                time.time(), decisionlog.MODE_CODES.get(mode_label, decisionlog.MODE_AUTO), path,
+                target_on, applied,
+                self.last_values.get("Td_ext"), self.last_values.get("Td_target"), Td_ref,
+                hum_vals, td_rooms, gaps, slopes, n_eval)
+        except Exception as e:
+            # un disque plein / en lecture seule ne doit jamais bloquer la régulation
+            Domoticz.Error(f"Decision log write error: {e} — log disabled")
+            self.decision_log.close()
+            self.decision_log = None
 
     # -------------- Device INFO --------------
     def post_state(self, mode_label, target_on):
 
         # suffixe Timer si actif
-        timer_tag = ""
+        timer_tag = left = ""
         if self.TimerOn:
             _, left = self._timer_remaining()
             if left:
@@ -504,36 +751,31 @@ class BasePlugin:
         else:
             txt = f"{mode_label}{timer_tag} — Boost {'ON' if target_on else 'OFF'}"
 
-        Devices[2].Update(nValue=0, sValue=txt)
+        # écrit sur Device 2 par le stage cosmétique update_info_device
+        self._info_txt = txt
 
-        # log debug 
-        Domoticz.Debug(
-            f"--------------DEBUG : {mode_label}{(' ' + timer_tag) if timer_tag else ''} | "
-            f"Boost → {'ON' if target_on else 'OFF' if target_on is False else 'HOLD'}"
-            )
+        self.trace.event("state", mode=mode_label, timer_left=left or None,
+                         Boost="HOLD" if target_on is None else target_on)
 
     # -------------- Mesures --------------
     def compute_hum_values(self):
         vals = []
-        for i, idx in enumerate(self.hum_idxs):
-            dev = self.get_device_by_idx(idx)
-            if not dev:
-                continue
-            val = None
-            if 'Humidity' in dev:
-                try:
-                    val = float(dev['Humidity'])
-                except Exception:
-                    val = None
-            elif 'Data' in dev:
-                try:
-                    d = str(dev['Data']).strip()
-                    if d.endswith('%'):
-                        val = float(d[:-1].strip())
-                except Exception:
-                    val = None
+        slopes = []  # pente RH (%/min) par pièce, alignée sur vals
+        now = time.monotonic()
+        for idx in self.hum_idxs:
+            _, val = self.read_TH(idx)
             if val is not None:
-                vals.append(max(0.0, min(100.0, val)))
+                val = max(0.0, min(100.0, val))
+                vals.append(val)
+                prev = self._rh_prev.get(idx)
+                if idx in self._fetched or prev is None:
+                    # pente calculée seulement sur un relevé réellement relu (cadence wet > 0 : valeur en cache sinon)
+                    slope = (val - prev[1]) / ((now - prev[0]) / 60.0) if prev and now > prev[0] else None
+                    self._rh_prev[idx] = (now, val, slope)
+                else:
+                    slope = prev[2]
+                slopes.append(slope)
+        self.last_values['slope_list'] = slopes
         return vals if vals else []
 
     def get_hum_status(self, hum_int):
@@ -550,59 +792,130 @@ class BasePlugin:
 
     # -------------- Relais --------------
     def switch_relay(self, on):
-        if not self.relay_idx:
+        # états relus seulement s'ils sont inconnus (démarrage, échec) ou tous les relay_check_cycles appels
+        self._relay_check_in -= 1
+        if self._relay_check_in <= 0 or not self.relay_idxs or None in self.relay_state.values():
+            self.setup_relay_group()  # groupe illisible au démarrage : nouvel essai
+            if self.relay_idxs:
+                self.read_relay_states()
+            self._relay_check_in = self.relay_check_cycles
+
+        if not self.relay_idxs:
             Domoticz.Error("Relay IDX not configured (Mode3)")
             return False
 
         desired = 'On' if on else 'Off'
+        todo = [idx for idx in self.relay_idxs if self.relay_state.get(idx) != desired]
 
-        # 1) Lire l’état actuel du relais
-        cur_state = None
-        dev = DomoticzAPI(f"type=command&param=getdevices&rid={self.relay_idx}")
-        try:
-            if dev and 'result' in dev and len(dev['result']) > 0:
-                d = dev['result'][0]
-                # Cas standard: champ "Status" vaut "On"/"Off"
-                cur_state = (d.get('Status') or '').strip()
-                if not cur_state:
-                    # Fallback: certains renvoient "Data" == "On"/"Off" ou "Set Level: 0/100"
-                    data = (d.get('Data') or '').strip()
-                    if data in ('On', 'Off'):
-                        cur_state = data
-                    else:
-                        # Fallback ultime: nValue (1=On, 0=Off)
-                        n = d.get('nValue')
-                        if n is not None:
-                            try:
-                                cur_state = 'On' if int(n) == 1 else 'Off'
-                            except Exception:
-                                cur_state = None
-        except Exception as e:
-            Domoticz.Error(f"Relay state read error: {e}")
-            cur_state = None
-
-        # 2) Si déjà dans le bon état, ne rien envoyer
-        if cur_state == desired:
-            if self.debug:
-                Domoticz.Debug(f"--------------DEBUG : Relay idx {self.relay_idx}: already {desired}, skipping command.")
+        # 1) Si déjà tous dans le bon état (état suivi), ne rien envoyer
+        if not todo:
+            self.trace.event("relay", relays=self.relay_idxs, already=desired)
             return True
 
-        # 3) Envoyer la commande uniquement si nécessaire
+        # 2) Envoyer la commande uniquement aux relais à changer : tous à changer + groupe Domoticz
+        #    composé exactement des relais configurés -> 1 appel switchscene, sinon 1 switchlight par relais
         cmd = desired
-        res = DomoticzAPI(f"type=command&param=switchlight&idx={self.relay_idx}&switchcmd={cmd}")
-        if not res or str(res.get('status', '')).lower() != 'ok':
-            Domoticz.Error(f"Relay command failure (idx {self.relay_idx}, cmd {cmd})")
-            return False
-
-        # met à jour le cache du cycle si le relais y figure déjà
-        if self.relay_idx in self._cycle_device_cache and self._cycle_device_cache[self.relay_idx]:
-            self._cycle_device_cache[self.relay_idx]['Status'] = desired
-            self._cycle_device_cache[self.relay_idx]['Data'] = desired
-            self._cycle_device_cache[self.relay_idx]['nValue'] = 1 if desired == 'On' else 0
+        if self.relay_group_is_exact() and len(todo) == len(self.relay_idxs):
+            res = self.api(f"type=command&param=switchscene&idx={self.relay_group}&switchcmd={cmd}",
+                              timeout=self.command_timeout())
+            if not res or str(res.get('status', '')).lower() != 'ok':
+                Domoticz.Error(f"Relay group command failure (group {self.relay_group}, cmd {cmd})")
+                done = []
+            else:
+                done = todo
+        else:
+            done = []
+            for idx in todo:
+                res = self.api(f"type=command&param=switchlight&idx={idx}&switchcmd={cmd}",
+                                  timeout=self.command_timeout())
+                if not res or str(res.get('status', '')).lower() != 'ok':
+                    Domoticz.Error(f"Relay command failure (idx {idx}, cmd {cmd})")
+                    continue
+                done.append(idx)
+
+        for idx in todo:
+            # échec : état inconnu -> relu au prochain appel
+            self.relay_state[idx] = desired if idx in done else None
+            # met à jour le cache du cycle si le relais y figure déjà
+            if idx in done and idx in self._cycle_device_cache and self._cycle_device_cache[idx]:
+                self._cycle_device_cache[idx]['Status'] = desired
+                self._cycle_device_cache[idx]['Data'] = desired
+                self._cycle_device_cache[idx]['nValue'] = 1 if desired == 'On' else 0
+
+        self.trace.event("relay", relays=todo, sent=cmd, ok=done)
+        return len(done) == len(todo)
+
+    def read_relay_states(self):
+        """Met à jour self.relay_state {idx: 'On'/'Off'} : membres du groupe en 1 appel (getscenedevices)
+        si un groupe est configuré, sinon (ou pour les relais hors groupe) 1 lecture rid par relais."""
+        wanted = set(self.relay_idxs)
+        seen = set()
+        if self.relay_group:
+            res = self.api(f"type=command&param=getscenedevices&idx={self.relay_group}&isscene=false",
+                              timeout=self.command_timeout())
+            try:
+                for d in (res or {}).get('result', []) or []:
+                    try:
+                        idx = int(d.get('DevRealIdx'))
+                    except Exception:
+                        continue
+                    if idx not in wanted:
+                        continue
+                    if 'IsOn' in d:
+                        self.relay_state[idx] = 'On' if d['IsOn'] else 'Off'
+                    else:
+                        self.relay_state[idx] = relay_state_from_device(d)
+                    seen.add(idx)
+            except Exception as e:
+                Domoticz.Error(f"Relay group {self.relay_group} state read error: {e}")
 
-        if self.debug:
-            Domoticz.Debug(f"--------------DEBUG : Relay idx {self.relay_idx}: sent {cmd} (prev={cur_state or 'unknown'})")
-        return True
+        for idx in self.relay_idxs:
+            if idx in seen:
+                continue
+            dev = self.api(f"type=command&param=getdevices&rid={idx}", timeout=self.command_timeout())
+            try:
+                if dev and 'result' in dev and len(dev['result']) > 0:
+                    self.relay_state[idx] = relay_state_from_device(dev['result'][0])
+            except Exception as e:
+                Domoticz.Error(f"Relay state read error (idx {idx}): {e}")
+
+    def setup_relay_group(self):
+        """Lit les membres du groupe 'G<idx>' tant qu'ils ne sont pas connus ; sans idx explicite en Mode3,
+        les relais sont les membres du groupe."""
+        if not self.relay_group or self.relay_group_members is not None:
+            return
+        members = self.resolve_relay_group()
+        if members is None:
+            return  # nouvel essai au prochain contrôle des relais
+        self.relay_group_members = members
+        if not self.relay_idxs:
+            self.relay_idxs = list(members)
+            self.relay_state = {idx: None for idx in self.relay_idxs}
+        if self.relay_group_is_exact():
+            Domoticz.Log(f"Relay group {self.relay_group}: relays {self.relay_idxs} switched in 1 call")
+        else:
+            Domoticz.Log(f"Relay group {self.relay_group} members {members} differ from relays {self.relay_idxs}"
+                         f" — relays switched one by one")
+
+    def relay_group_is_exact(self):
+        # switchscene commute TOUS les membres : seulement si ce sont exactement les relais configurés
+        return (self.relay_group is not None and self.relay_group_members is not None
+                and set(self.relay_group_members) == set(self.relay_idxs))
+
+    def resolve_relay_group(self):
+        """Relais membres du groupe Domoticz ; None si le groupe n'a pas pu être lu."""
+        res = self.api(f"type=command&param=getscenedevices&idx={self.relay_group}&isscene=false",
+                          timeout=self.command_timeout())
+        if not res:
+            Domoticz.Error(f"Relay group {self.relay_group} read error — retried later")
+            return None
+        members = []
+        for d in res.get('result', []) or []:
+            try:
+                members.append(int(d.get('DevRealIdx')))
+            except (TypeError, ValueError):
+                continue
+        return members
 
     # -------------- Timer --------------
     def _timer_remaining(self, now=None):
@@ -616,21 +929,137 @@ class BasePlugin:
         mins = max(0, int((delta + 59) // 60))  # arrondi à la minute sup
         return mins, f"{mins} mins"
 
+    # -------------- API --------------
+    def api(self, call, timeout=None):
+        self.trace.event("api", request=call)  # formaté seulement si Debug actif ou dump
+        return DomoticzAPI(call, timeout=timeout)
+
     # -------------- get_device_by_idx --------------
     def get_device_by_idx(self, idx):
         if idx in self._cycle_device_cache:
             return self._cycle_device_cache[idx]
 
-        res = DomoticzAPI(f"type=command&param=getdevices&rid={idx}")
+        timeout = self.read_timeout()
+        if timeout is None:
+            # budget épuisé : lecture sautée (None non gardé en cache -> relue au cycle suivant)
+            self._skipped_reads.append(idx)
+            self._cycle_device_cache[idx] = None
+            return None
+        res = self.api(f"type=command&param=getdevices&rid={idx}", timeout=timeout)
         if res and 'result' in res and len(res['result']) > 0:
             dev = res['result'][0]
             self._cycle_device_cache[idx] = dev
+            self._fetched.add(idx)
             return dev
 
         Domoticz.Error(f"Device idx {idx} introuvable")
         self._cycle_device_cache[idx] = None
         return None
 
+    # -------------- Index des sondes --------------
+    def read_TH(self, idx):
+        """(T, RH) d'une sonde via le parser indexé : le format n'est sondé qu'à la 1ère lecture."""
+        dev = self.get_device_by_idx(idx)
+        if not dev:
+            return None, None
+        entry = self.device_index.get(idx)
+        if entry is not None:
+            try:
+                return entry[2](dev)
+            except (KeyError, IndexError):
+                pass  # format changé (sonde remplacée) : on reclasse
+        dtype, parser = classify_device(dev)
+        if parser is None:
+            self.device_index.pop(idx, None)
+            return None, None
+        self.device_index[idx] = (self._group_of.get(idx), dtype, parser)
+        try:
+            return parser(dev)
+        except (KeyError, IndexError):
+            return None, None
+
+    def discover_sensors(self, force=False):
+        """Mode découverte : rôles des sondes Temp/Hum d'après les plans (pièces) Domoticz.
+        Relu seulement si la liste des plans ou leur nombre de devices a changé."""
+        plans = self.api("type=command&param=getplans&order=name&used=true")
+        if not plans or 'result' not in plans:
+            return False
+        signature = tuple(sorted((str(p.get('idx')), p.get('Name', ''), str(p.get('Devices', '')))
+                                 for p in plans['result']))
+        if signature == self._plan_signature and not force:
+            return False
+
+        # 1 seul appel pour le type de toutes les sondes Temp/Hum
+        sensors = {}
+        res = self.api("type=command&param=getdevices&filter=temp&used=true")
+        for d in (res or {}).get('result', []) or []:
+            try:
+                sensors[int(d.get('idx'))] = d
+            except Exception:
+                continue
+
+        found = {"outdoor": [], "normal": [], "wet": []}
+        index = {}
+        for p in plans['result']:
+            name = p.get('Name', '')
+            role = plan_role(name)
+            devs = self.api(f"type=command&param=getplandevices&idx={p.get('idx')}")
+            for d in (devs or {}).get('result', []) or []:
+                if str(d.get('type', 0)) != '0':
+                    continue  # 1 = scène/groupe : son idx peut recouper celui d'une sonde
+                try:
+                    idx = int(d.get('devidx'))
+                except Exception:
+                    continue
+                dev = sensors.get(idx)
+                if dev is None or idx in index:
+                    continue
+                dtype, parser = classify_type(dev.get('Type', ''))
+                if parser is None:
+                    dtype, parser = classify_device(dev)
+                if parser is None:
+                    continue
+                if dtype not in DISCOVERY_TYPES[role]:
+                    # pièce humide : seule l'humidité déclenche la VMC ; ext./normales : T ET RH pour Td_ext/Td_target
+                    # (une sonde Temp seule - frigo, chaudière... - fausserait T_ext/T_int)
+                    Domoticz.Log(f"Room plans discovery: idx {idx} ({dtype}) in plan '{name}' ignored "
+                                 f"— {role} role needs {'/'.join(DISCOVERY_TYPES[role])}")
+                    continue
+                index[idx] = (role, dtype, parser)
+                found[role].append(idx)
+                Domoticz.Log(f"Room plans discovery: idx {idx} ({dtype}) from plan '{name}' -> {role}")
+
+        self._plan_signature = signature
+        if not found["wet"]:
+            Domoticz.Error("Room plans discovery: no wet room Temp/Hum sensor found — manual idx lists kept")
+            return False
+
+        self.outdoor_idxs = found["outdoor"] or self.outdoor_idxs
+        self.indoor_idxs = found["normal"] or self.indoor_idxs
+        self.hum_idxs = found["wet"]
+        self.build_groups()
+        self.device_index = index
+        self._rh_prev = {idx: v for idx, v in self._rh_prev.items() if idx in self.hum_idxs}
+        self._ref_pending = True
+        Domoticz.Log(f"Room plans discovery: outdoor={self.outdoor_idxs} normal={self.indoor_idxs} "
+                     f"wet={self.hum_idxs}")
+        return True
+
+    def check_discovery(self):
+        now = time.monotonic()
+        if self._discovery_at is not None and now - self._discovery_at < self.discovery_interval:
+            return
+        self._discovery_at = now
+        self.discover_sensors()
+
+    def build_groups(self):
+        # groupe de chaque sonde (une sonde présente dans 2 listes suit la cadence la plus rapide)
+        self._group_of = {}
+        for group, idxs in sorted((("outdoor", self.outdoor_idxs), ("normal", self.indoor_idxs),
+                                   ("wet", self.hum_idxs)), key=lambda g: -self.poll_intervals[g[0]]):
+            for idx in idxs:
+                self._group_of[idx] = group
+
     # -------------- Write Log --------------
     def WriteLog(self, message, level="Normal"):
 
@@ -650,88 +1079,102 @@ def dew_point_celsius(T_c, RH_pct):
     gamma = (a * T) / (b + T) + math.log(RH / 100.0)
     return (b * gamma) / (a - gamma)
 
-def avg_T_RH_from_idxs(idx_list, get_device_fn):
-    """Return (T_avg, RH_avg) from Domoticz Temp+Humidity devices (CSV idx list)."""
+def avg_T_RH_from_idxs(idx_list, read_fn):
+    """Return (T_avg, RH_avg) from Domoticz Temp/Humidity devices (read_fn(idx) -> (T, RH))."""
     Ts, RHs = [], []
     for idx in idx_list or []:
-        dev = get_device_fn(idx)
-        if not dev:
-            continue
-        t = None
-        if 'Temp' in dev:
-            try:
-                t = float(dev['Temp'])
-            except Exception:
-                t = None
-        elif 'Data' in dev and 'C' in str(dev['Data']):
-            try:
-                part = str(dev['Data']).split(',')[0]
-                t = float(part.strip().split(' ')[0])
-            except Exception:
-                t = None
+        t, h = read_fn(idx)
         if t is not None:
             Ts.append(t)
-        h = None
-        if 'Humidity' in dev:
-            try:
-                h = float(dev['Humidity'])
-            except Exception:
-                h = None
-        elif 'Data' in dev and '%' in str(dev['Data']):
-            try:
-                part = str(dev['Data']).split(',')[1]
-                h = float(part.strip().replace('%','').strip())
-            except Exception:
-                h = None
         if h is not None:
             RHs.append(h)
     T_avg = sum(Ts)/len(Ts) if Ts else None
     RH_avg = sum(RHs)/len(RHs) if RHs else None
     return T_avg, RH_avg
 
-def compute_room_td_list(self):
-    def fmt1(x, unit=""):
-        return "-" if x is None else f"{x:.1f}{unit}"
+# Sensor formats & room plans ------------------------------------------------------------------------------------------
+WET_PLAN_WORDS = ("sdb", "salle de bain", "salle d'eau", "bain", "douche", "wc", "toilet", "bath", "shower",
+                  "cuisine", "kitchen", "buanderie", "laundry", "humide", "wet")
+OUTDOOR_PLAN_WORDS = ("extérieur", "exterieur", "outdoor", "outside", "dehors", "jardin", "garden", "terrasse")
+DISCOVERY_TYPES = {"outdoor": ("TH",), "normal": ("TH",), "wet": ("TH", "H")}  # types retenus par rôle
+
+def plan_role(name):
+    """Rôle d'un plan Domoticz d'après son nom : 'outdoor', 'wet' ou 'normal'."""
+    n = (name or "").lower()
+    if any(w in n for w in OUTDOOR_PLAN_WORDS):
+        return "outdoor"
+    if any(w in n for w in WET_PLAN_WORDS):
+        return "wet"
+    return "normal"
+
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
 
+def parse_TH(dev):
+    return _num(dev['Temp']), _num(dev['Humidity'])
+
+def parse_T(dev):
+    return _num(dev['Temp']), None
+
+def parse_H(dev):
+    return None, _num(dev['Humidity'])
+
+def parse_data_TH(dev):
+    # "21.5 C, 55 %"
+    parts = str(dev['Data']).split(',')
+    return _num(parts[0].strip().split(' ')[0]), _num(parts[1].strip().replace('%', '').strip())
+
+def parse_data_H(dev):
+    # "55 %"
+    d = str(dev['Data']).strip()
+    if not d.endswith('%'):
+        raise KeyError('Data')
+    return None, _num(d[:-1].strip())
+
+def classify_device(dev):
+    """(type, parser) d'après le contenu d'un device (sondage fait une seule fois par idx)."""
+    if 'Temp' in dev and 'Humidity' in dev:
+        return "TH", parse_TH
+    if 'Humidity' in dev:
+        return "H", parse_H
+    if 'Temp' in dev:
+        return "T", parse_T
+    data = str(dev.get('Data', ''))
+    if 'C' in data and '%' in data and ',' in data:
+        return "TH", parse_data_TH
+    if data.strip().endswith('%'):
+        return "H", parse_data_H
+    return None, None
+
+def classify_type(type_name):
+    """(type, parser) d'après le champ Type Domoticz ('Temp + Humidity', 'Temp', 'Humidity'...)."""
+    t = (type_name or "").lower()
+    if t.startswith("temp + humidity"):
+        return "TH", parse_TH
+    if t == "humidity":
+        return "H", parse_H
+    if t == "temp":
+        return "T", parse_T
+    return None, None
+
+def compute_room_td_list(self):
     Td_list = []
     T_int = self.last_values.get("T_int") or 21.0
 
-    per_sensor_logs = []  # pour un récap en fin
-
-    for i, idx in enumerate(self.hum_idxs):
-        dev = self.get_device_by_idx(idx)
-        if not dev:
-            continue
-
-        # --- RH pièce ---
-        RH = None
-        if 'Humidity' in dev:
-            try:
-                RH = float(dev['Humidity'])
-            except Exception:
-                RH = None
-        elif 'Data' in dev:
-            try:
-                d = str(dev['Data']).strip()
-                if d.endswith('%'):
-                    RH = float(d[:-1].strip())
-            except Exception:
-                RH = None
+    for idx in self.hum_idxs:
+        # --- RH pièce + Temp de la sonde (si dispo) ---
+        T_room, RH = self.read_TH(idx)
         if RH is None:
-            if self.debug:
-                Domoticz.Debug(f"--------------DEBUG : ΔTd: idx={idx} RH=NA (pas de valeur) – ignoré")
+            self.trace.event("td_room", idx, RH=None, skipped=True)
             continue
 
         # --- Clamp sans offset ---
         RH = max(0.0, min(100.0, RH))
 
-        # --- Temp de la sonde (si dispo), sinon T_int ---
-        T_room = None
-        if 'Temp' in dev:
-            try:
-                T_room = float(dev['Temp'])
-            except Exception:
-                T_room = None
+        # --- sinon T_int ---
         if T_room is None:
             T_room = T_int
 
@@ -741,28 +1184,54 @@ def compute_room_td_list(self):
 
     return Td_list
 
+def relay_state_from_device(d):
+    """'On'/'Off' depuis un device switch Domoticz (Status, sinon Data, sinon nValue), None si inconnu."""
+    # Cas standard: champ "Status" vaut "On"/"Off"
+    state = (d.get('Status') or '').strip()
+    if state in ('On', 'Off'):
+        return state
+    # Fallback: certains renvoient "Data" == "On"/"Off" ou "Set Level: 0/100"
+    data = (d.get('Data') or '').strip()
+    if data in ('On', 'Off'):
+        return data
+    # Fallback ultime: nValue (1=On, 0=Off)
+    n = d.get('nValue')
+    if n is not None:
+        try:
+            return 'On' if int(n) == 1 else 'Off'
+        except Exception:
+            return None
+    return state or None
+
 # Plugin helpers & utility functions -----------------------------------------------------------------------------------
 
 # Domoticz API  --------------------------------------------------------------------------------------------------------
 
-def DomoticzAPI(APICall):
+API_URL = "http://127.0.0.1:8080/json.htm"
+API_TIMEOUT = 10  # s : un Domoticz qui ne répond plus ne doit pas bloquer le heartbeat indéfiniment
+API_MIN_TIMEOUT = 1.0  # s : timeout plancher d'un appel sur le chemin critique
+RELAY_RESERVE = 0.25  # part du budget de cycle gardée pour les commandes relais (lectures critiques sautées avant)
+
+def DomoticzAPI(APICall, timeout=None):
     resultJson = None
-    url = f"http://127.0.0.1:8080/json.htm?{parse.quote(APICall, safe='&=')}"
+    url = f"{API_URL}?{parse.quote(APICall, safe='&=')}"
+    if timeout is None:
+        timeout = API_TIMEOUT
 
     try:
-        Domoticz.Debug(f"Domoticz API request: {url}")
         req = request.Request(url)
-        response = request.urlopen(req)
-
-        if response.status == 200:
-            resultJson = json.loads(response.read().decode('utf-8'))
-            if resultJson.get("status") == "ERR":
-                Domoticz.Error(f"Domoticz API returned an error: status = {resultJson.get('status')}")
-                resultJson = None
-        else:
-            Domoticz.Error(f"Domoticz API: HTTP error = {response.status}")
+        # with : la socket est toujours refermée (plugin résident pendant des mois)
+        with request.urlopen(req, timeout=timeout) as response:
+            if response.status == 200:
+                resultJson = json.loads(response.read().decode('utf-8'))
+                if resultJson.get("status") == "ERR":
+                    Domoticz.Error(f"Domoticz API returned an error: status = {resultJson.get('status')}")
+                    resultJson = None
+            else:
+                Domoticz.Error(f"Domoticz API: HTTP error = {response.status}")
 
     except urllib.error.HTTPError as e:
+        e.close()
         Domoticz.Error(f"HTTP error calling '{url}': {e}")
     except urllib.error.URLError as e:
         Domoticz.Error(f"URL error calling '{url}': {e}")
@@ -777,6 +1246,35 @@ def DomoticzAPI(APICall):
 def parseCSV_to_ints(s):
     return [int(x.strip()) for x in s.split(',') if x.strip().isdigit()]
 
+def parse_relay_param(s):
+    """'12,13' -> ([12, 13], None) ; 'G5' -> ([], 5) ; 'G5,12,13' -> ([12, 13], 5) ; '12.0' -> ([12], None)"""
+    def to_idx(x):
+        try:
+            return int(float(x)) or None
+        except (ValueError, OverflowError):
+            return None
+
+    relays, group = [], None
+    for x in s.split(','):
+        x = x.strip()
+        if x[:1] in ('G', 'g'):
+            group = to_idx(x[1:]) or group
+        else:
+            idx = to_idx(x)
+            if idx:
+                relays.append(idx)
+    return relays, group
+
+def parseCSV_positional_floats(s, n):
+    """Liste de n floats par position ; None pour un champ absent, vide ou invalide."""
+    out = []
+    for x in (s.split(',') + [''] * n)[:n]:
+        try:
+            out.append(float(x.strip()))
+        except ValueError:
+            out.append(None)
+    return out
+
 def parseCSV_to_floats(s):
     out = []
     for x in s.split(','):
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: ErwanBCN,
+# Moteur de règles VMC DF : règles ON/OFF déclaratives (seuils/prédicats sur RH, Td, ΔTd, pente RH, Td ext...),
+# compilées une fois en une fonction Python qui évalue toutes les pièces humides en une seule passe.
+# Module autonome (stdlib uniquement) : utilisé par le plugin ET pour rejouer un journal decisionlog.
+#
+# Format (une règle par ligne, '#' = commentaire) :
+#
+#   [dtd]                                   # utilisé quand Td_ref et les Td pièces sont disponibles
+#   on  any RH >= High and dTd >= td_on     # ON si au moins une pièce vérifie la condition
+#   off all dTd <= td_off or RH <= Low      # OFF si toutes les pièces la vérifient
+#   [fallback]                              # sinon (pas de référence ΔTd)
+#   on  any RH >= High
+#   off all RH <= Low
+#
+# Décision : une règle 'on' vraie -> ON, sinon une règle 'off' vraie -> OFF, sinon HOLD (état précédent).
+# Variables par pièce : RH (%), Td (°C), dTd (°C, Td pièce - Td_ref), slope (RH %/min)
+# Variables globales  : Td_ext, Td_int, Td_ref (°C)
+# Constantes (Mode5)  : High, Low, td_on, td_off, td_eps
+# Une valeur manquante vaut NaN : toute comparaison avec elle est fausse. Chaque terme d'une condition
+# (reliés par and/or) doit donc être une comparaison : 'on any RH' est refusé, de même que 'not' et '!='
+# (vrais face à NaN) : écrire la comparaison inverse ('RH < 70' plutôt que 'not RH >= 70').
+
+import ast
+import re
+from array import array
+
+import decisionlog
+
+SECTIONS = ("dtd", "fallback")
+ROOM_VARS = ("RH", "Td", "dTd", "slope")
+GLOBAL_VARS = ("Td_ext", "Td_int", "Td_ref")
+
+NAN = float("nan")
+
+DEFAULT_RULES = """
+[dtd]
+# ON si au moins UNE pièce : RH>=High ET ΔTd>=td_on
+on  any RH >= High and dTd >= td_on
+# OFF si TOUTES les pièces : (ΔTd<=td_off) OU ((ΔTd>=td_off) ET (RH<=Low))
+off all dTd <= td_off or RH <= Low
+[fallback]
+on  any RH >= High
+off all RH <= Low
+"""
+
+_TOKEN = re.compile(r"\s*(?:(\d+(?:\.\d*)?|\.\d+)|([A-Za-z_]\w*)|(>=|<=|==|!=|<|>|\(|\)|-))")
+_KEYWORDS = ("and", "or")
+
+
+class RuleError(ValueError):
+    pass
+
+
+def _translate(expr, consts, lineno):
+    """Valide l'expression (liste blanche de tokens) et la traduit en expression Python."""
+    out, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _TOKEN.match(expr, pos)
+        if not m or m.end() == pos:
+            raise RuleError(f"line {lineno}: unexpected '{expr[pos:].strip()}'")
+        num, name, op = m.groups()
+        if num is not None:
+            out.append(repr(float(num)))
+        elif name is not None:
+            if name == "not":
+                raise RuleError(f"line {lineno}: 'not' is not supported (true for a missing value), "
+                                f"write the opposite comparison")
+            if name in _KEYWORDS or name in ROOM_VARS or name in GLOBAL_VARS:
+                out.append(name)
+            elif name in consts:
+                out.append(repr(float(consts[name])))
+            else:
+                raise RuleError(f"line {lineno}: unknown name '{name}'")
+        elif op == "!=":
+            raise RuleError(f"line {lineno}: '!=' is not supported (true for a missing value), use '<' or '>'")
+        else:
+            out.append(op)
+        pos = m.end()
+    if not out:
+        raise RuleError(f"line {lineno}: empty condition")
+    py = " ".join(out)
+    try:
+        tree = ast.parse(py, "<rule>", "eval")
+    except SyntaxError:
+        raise RuleError(f"line {lineno}: invalid condition '{expr}'") from None
+    if not _is_condition(tree.body):
+        raise RuleError(f"line {lineno}: every term of '{expr}' must be a comparison (e.g. RH >= High)")
+    return py
+
+
+def _is_value(node):
+    if isinstance(node, (ast.Name, ast.Constant)):
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return _is_value(node.operand)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Sub):
+        return _is_value(node.left) and _is_value(node.right)
+    return False
+
+
+def _is_condition(node):
+    """and/or de comparisons uniquement (une valeur nue, NaN compris, serait 'vraie')."""
+    if isinstance(node, ast.BoolOp):
+        return all(_is_condition(v) for v in node.values)
+    if isinstance(node, ast.Compare):
+        return _is_value(node.left) and all(_is_value(c) for c in node.comparators)
+    return False
+
+
+def parse_rules(text, consts):
+    """Retourne {section: [(kind, quantifier, expr_python, source)]}."""
+    rules = {s: [] for s in SECTIONS}
+    section = "dtd"
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("["):
+            section = line.strip("[] ").lower()
+            if section not in SECTIONS:
+                raise RuleError(f"line {lineno}: unknown section '[{section}]'")
+            continue
+        parts = line.split(None, 2)
+        if len(parts) < 3 or parts[0] not in ("on", "off") or parts[1] not in ("any", "all"):
+            raise RuleError(f"line {lineno}: expected 'on|off any|all <condition>'")
+        kind, quant, cond = parts
+        rules[section].append((kind, quant, _translate(cond, consts, lineno), line))
+    return rules
+
+
+def _codegen(name, section_rules):
+    """Une fonction par section : une seule boucle sur les pièces, tous les prédicats à la fois."""
+    args = ", ".join(f"{v}_l" for v in ROOM_VARS) + ", " + ", ".join(GLOBAL_VARS)
+    src = [f"def {name}({args}):"]
+    for k, (_, quant, _, _) in enumerate(section_rules):
+        src.append(f"    r{k} = {quant == 'all'}")
+    if section_rules:
+        src.append(f"    for {', '.join(ROOM_VARS)} in zip({', '.join(f'{v}_l' for v in ROOM_VARS)}):")
+        for k, (_, quant, expr, _) in enumerate(section_rules):
+            if quant == "any":
+                src.append(f"        if not r{k} and ({expr}): r{k} = True")
+            else:
+                src.append(f"        if r{k} and not ({expr}): r{k} = False")
+    on = [f"r{k}" for k, r in enumerate(section_rules) if r[0] == "on"] or ["False"]
+    off = [f"r{k}" for k, r in enumerate(section_rules) if r[0] == "off"] or ["False"]
+    src.append(f"    return ({' or '.join(on)}), ({' or '.join(off)})")
+    return "\n".join(src)
+
+
+def _pad(vals, n):
+    vals = [NAN if v is None else v for v in (vals or [])[:n]]
+    return vals + [NAN] * (n - len(vals))
+
+
+class RuleSet:
+    """Jeu de règles compilé. evaluate() pour le cycle courant, replay() pour un historique."""
+
+    def __init__(self, text=DEFAULT_RULES, High=75.0, Low=55.0, td_on=1.0, td_off=0.5, td_eps=2.0):
+        self.text = text
+        consts = dict(High=High, Low=Low, td_on=td_on, td_off=td_off, td_eps=td_eps)
+        self.rules = parse_rules(text, consts)
+        ns = {}
+        for section in SECTIONS:
+            exec(_codegen(f"_eval_{section}", self.rules[section]), {"__builtins__": {"zip": zip}}, ns)
+        self._eval = {section: ns[f"_eval_{section}"] for section in SECTIONS}
+
+    def evaluate(self, section, RH, Td=None, dTd=None, slope=None, Td_ext=None, Td_int=None, Td_ref=None):
+        """Retourne (on, off) ; listes par pièce alignées sur RH (valeurs manquantes -> NaN)."""
+        n = len(RH)
+        return self._eval[section](
+            _pad(RH, n), _pad(Td, n), _pad(dTd, n), _pad(slope, n),
+            NAN if Td_ext is None else Td_ext, NAN if Td_int is None else Td_int,
+            NAN if Td_ref is None else Td_ref)
+
+    @staticmethod
+    def decide(on, off, last_on):
+        if on:
+            return True
+        if off:
+            return False
+        return last_on
+
+    def replay(self, cols, last_on=False):
+        """Rejoue le jeu de règles sur DecisionLogReader/DecisionLogChain.columns() : array('b'), 1 valeur par
+        enregistrement : 1=ON 0=OFF, STATE_NONE (-1) pour un enregistrement Forced/Timer (non évalué).
+        Comme en live : section choisie d'après le 'path' enregistré, mêmes entrées (n_eval premières pièces,
+        pente RH enregistrée), état maintenu si pas de mesure (NODATA), état Auto inchangé pendant Forced/Timer."""
+        out = array("b")
+        paths, n_eval = cols["path"], cols["n_eval"]
+        rh, td, gap, slope = cols["rh"], cols["td"], cols["gap"], cols["slope"]
+        Td_ext, Td_int, Td_ref = cols["Td_ext"], cols["Td_target"], cols["Td_ref"]
+        for i in range(len(paths)):
+            path = paths[i]
+            if path == decisionlog.PATH_FORCED:
+                out.append(decisionlog.STATE_NONE)
+                continue
+            if path in (decisionlog.PATH_DTD, decisionlog.PATH_FALLBACK):
+                n = int(n_eval[i])
+                on, off = self._eval["dtd" if path == decisionlog.PATH_DTD else "fallback"](
+                    [rh[k][i] for k in range(n)], [td[k][i] for k in range(n)], [gap[k][i] for k in range(n)],
+                    [slope[k][i] for k in range(n)], Td_ext[i], Td_int[i], Td_ref[i])
+                last_on = self.decide(on, off, last_on)
+            # PATH_NODATA : HOLD, état précédent conservé
+            out.append(1 if last_on else 0)
+        return out
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author: ErwanBCN,
+# Soak test VMC DF : des millions de onHeartbeat/onCommand simulés contre un stub local de l'API Domoticz,
+# horloge virtuelle, snapshots tracemalloc + percentiles de latence par fenêtre.
+# Les appels passent par le vrai DomoticzAPI (urllib + décodage JSON) ; seul le transport est simulé.
+# Echec (code retour 1) si la mémoire, les descripteurs ouverts ou le p99 du cycle dérivent au-delà des seuils,
+# si une ResourceWarning est émise, ou si le chemin critique (virtuel) dépasse le budget du cycle.
+#
+#   python3 soak.py                         # 1 000 000 cycles, transport urllib en process (sans socket)
+#   python3 soak.py --cycles 5000000
+#   python3 soak.py --scenario stress       # API lente avec blocages, groupe de relais G<idx>, découverte par plans
+#   python3 soak.py --http --cycles 20000   # vrai serveur HTTP local : sockets urllib réelles
+
+import argparse
+import gc
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.response
+import warnings
+from array import array
+from datetime import datetime
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HEARTBEAT = 20.0  # s virtuelles entre 2 heartbeats
+
+OUTDOOR = [101]
+NORMAL = [201, 202]
+WET = [301, 302]
+RELAYS = [401, 402]
+RELAY_GROUP = 900
+
+# plans Domoticz du scénario stress (découverte) : nom -> idx
+PLANS = {1: ("Jardin", OUTDOOR), 2: ("Salon", NORMAL[:1]), 3: ("Chambre", NORMAL[1:]),
+         4: ("Salle de bain", WET[:1]), 5: ("Cuisine", WET[1:])}
+FRIDGE = 501  # sonde Temp seule (cave à vin) dans le salon : à ignorer par la découverte
+# (devidx, type) en plus des sondes ; type 1 = scène dont l'idx recoupe une sonde de pièce humide
+PLAN_EXTRAS = {2: [(FRIDGE, 0), (WET[0], 1)]}
+
+SCENARIOS = {
+    # latence API virtuelle (s), 1 appel bloqué (jusqu'au timeout) tous les N appels, Mode3, découverte
+    "basic": dict(latency=0.0, hang_every=0, mode3=",".join(map(str, RELAYS)), discovery=0),
+    "stress": dict(latency=1.5, hang_every=200, mode3=f"G{RELAY_GROUP}", discovery=1),
+}
+
+
+# ----------------------------- Horloge virtuelle -----------------------------
+
+class VirtualClock:
+    def __init__(self, start=1.7e9):
+        self.t = start
+
+    def advance(self, dt):
+        self.t += dt
+
+    def time(self):
+        return self.t
+
+    def monotonic(self):
+        return self.t
+
+    def datetime_cls(self):
+        clock = self
+
+        class VirtualDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return cls.fromtimestamp(clock.t, tz)
+
+        return VirtualDatetime
+
+    def time_module(self):
+        # remplace le module time vu par le plugin (le reste de time reste disponible)
+        mod = types.SimpleNamespace(**{k: getattr(time, k) for k in dir(time) if not k.startswith("_")})
+        mod.time = self.time
+        mod.monotonic = self.monotonic
+        return mod
+
+
+# ----------------------------- Stub Domoticz -----------------------------
+
+class FakeDevice:
+    def __init__(self, Unit, Name="", **kw):
+        self.Unit = Unit
+        self.Name = Name
+        self.ID = Unit
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+
+    def Create(self):
+        _devices[self.Unit] = self
+
+    def Update(self, nValue, sValue):
+        self.nValue = nValue
+        self.sValue = sValue
+
+
+_devices = {}
+_counters = {"log": 0, "error": 0, "debug": 0}
+
+
+def install_fake_domoticz(parameters):
+    """Module 'Domoticz' minimal (il n'existe que dans le process Domoticz)."""
+    mod = types.ModuleType("Domoticz")
+    mod.Log = lambda m: _counters.__setitem__("log", _counters["log"] + 1)
+    mod.Status = mod.Log
+    mod.Error = lambda m: _counters.__setitem__("error", _counters["error"] + 1)
+    mod.Debug = lambda m: _counters.__setitem__("debug", _counters["debug"] + 1)
+    mod.Debugging = lambda level: None
+    mod.Heartbeat = lambda s: None
+    mod.Device = FakeDevice
+    mod.Devices = _devices
+    mod.Parameters = parameters
+    sys.modules["Domoticz"] = mod
+    return mod
+
+
+class SensorModel:
+    """Relevés simulés : extérieur sinusoïdal, douches périodiques dans les pièces humides."""
+
+    def __init__(self, clock, seed, latency=0.0, hang_every=0):
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.relay = {idx: "Off" for idx in RELAYS}
+        self.phase = {idx: self.rng.uniform(0, 86400) for idx in WET}
+        self.latency = latency
+        self.hang_every = hang_every
+        self.calls = 0
+        self.timeouts = 0
+
+    def transport(self, query, timeout):
+        """Temps d'un appel sur l'horloge virtuelle (le scheduler du plugin le voit) ; timeout -> socket.timeout."""
+        self.calls += 1
+        cost = self.latency * self.rng.uniform(0.5, 1.5)
+        if self.hang_every and self.calls % self.hang_every == 0:
+            cost = 60.0  # Domoticz bloqué : seul le timeout du plugin borne l'attente
+        if timeout is not None and cost > timeout:
+            self.clock.advance(timeout)
+            self.timeouts += 1
+            raise TimeoutError("timed out")
+        self.clock.advance(cost)
+        return self.handle(query)
+
+    def reading(self, idx):
+        t = self.clock.t
+        day = math.sin(2 * math.pi * (t % 86400) / 86400)
+        if idx in OUTDOOR:
+            T, RH = 12 + 6 * day, 75 - 15 * day
+        elif idx in NORMAL:
+            T, RH = 21 + 0.5 * day, 50 + 3 * day
+        else:
+            # douche ~ toutes les 8 h : pic à 95 % puis décroissance sur ~40 min
+            since = (t + self.phase[idx]) % 28800
+            T, RH = 22.0, 55 + 40 * math.exp(-since / 900.0)
+        RH += self.rng.uniform(-0.5, 0.5)
+        return {"idx": str(idx), "Temp": round(T, 1), "Humidity": round(RH), "Data": f"{T:.1f} C, {RH:.0f} %"}
+
+    def handle(self, query):
+        """Retourne le texte JSON que renverrait Domoticz pour 'query'."""
+        q = dict(urllib.parse.parse_qsl(query))
+        param = q.get("param")
+        if param == "getdevices" and "rid" in q:
+            idx = int(q["rid"])
+            if idx in self.relay:
+                res = [{"idx": str(idx), "Status": self.relay[idx]}]
+            else:
+                res = [self.reading(idx)]
+        elif param == "getdevices" and q.get("filter") == "temp":
+            res = [dict(self.reading(idx), Type="Temp + Humidity") for idx in OUTDOOR + NORMAL + WET]
+            res.append({"idx": str(FRIDGE), "Type": "Temp", "Temp": 4.0, "Data": "4.0 C"})
+        elif param == "getdevices":
+            res = [{"idx": str(idx), "Status": st} for idx, st in self.relay.items()]
+        elif param == "switchlight":
+            self.relay[int(q["idx"])] = q["switchcmd"]
+            res = None
+        elif param == "switchscene" and int(q["idx"]) == RELAY_GROUP:
+            for idx in self.relay:
+                self.relay[idx] = q["switchcmd"]
+            res = None
+        elif param == "getscenedevices" and int(q["idx"]) == RELAY_GROUP:
+            res = [{"DevRealIdx": str(idx), "IsOn": self.relay[idx] == "On"} for idx in RELAYS]
+        elif param == "getplans":
+            res = [{"idx": str(k), "Name": name, "Devices": len(idxs) + len(PLAN_EXTRAS.get(k, []))}
+                   for k, (name, idxs) in PLANS.items()]
+        elif param == "getplandevices":
+            plan = int(q["idx"])
+            res = [{"devidx": str(idx), "type": 0} for idx in PLANS[plan][1]]
+            res += [{"devidx": str(idx), "type": t} for idx, t in PLAN_EXTRAS.get(plan, [])]
+        else:
+            return json.dumps({"status": "ERR"})
+        out = {"status": "OK"}
+        if res is not None:
+            out["result"] = res
+        return json.dumps(out)
+
+
+class StubHandler(urllib.request.BaseHandler):
+    """Transport urllib en process : Request, opener, réponse (context manager) et json.loads du plugin
+    sont exercés, sans socket."""
+    handler_order = 100  # avant HTTPHandler
+
+    def __init__(self, model):
+        self.model = model
+
+    def http_open(self, req):
+        query = urllib.parse.unquote(urllib.parse.urlsplit(req.full_url).query)
+        try:
+            body = self.model.transport(query, req.timeout).encode("utf-8")
+        except TimeoutError as e:
+            raise urllib.error.URLError(e)
+        headers = Message()
+        headers["Content-Type"] = "application/json"
+        resp = urllib.response.addinfourl(io.BytesIO(body), headers, req.full_url, 200)
+        resp.msg = "OK"  # lu par HTTPErrorProcessor
+        return resp
+
+
+def open_fds():
+    """Nb de descripteurs ouverts par le process (None si /proc indisponible)."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def start_http_stub(model):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = urllib.parse.urlsplit(self.path).query
+            with lock:
+                body = model.transport(urllib.parse.unquote(query), None).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ----------------------------- Mesures -----------------------------
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(math.ceil(p / 100.0 * len(sorted_vals))) - 1))
+    return sorted_vals[k]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="VMC DF plugin soak test (memory + latency drift)")
+    ap.add_argument("--cycles", type=int, default=1_000_000, help="nombre de heartbeats simulés")
+    ap.add_argument("--window", type=int, default=50_000, help="cycles entre 2 snapshots mémoire/latence")
+    ap.add_argument("--warmup", type=int, default=1, help="fenêtres ignorées avant la mesure de référence")
+    ap.add_argument("--mem-kib", type=float, default=256.0, help="croissance mémoire tolérée (KiB)")
+    ap.add_argument("--fd-slack", type=int, default=4, help="descripteurs ouverts en plus tolérés vs référence")
+    ap.add_argument("--p99-drift", type=float, default=2.0, help="ratio p99 toléré vs fenêtre de référence")
+    ap.add_argument("--p99-floor-ms", type=float, default=1.0, help="p99 en dessous duquel on ne juge pas la dérive")
+    ap.add_argument("--drift-windows", type=int, default=3,
+                    help="fenêtres consécutives au-delà du seuil p99 avant échec (filtre les pics isolés)")
+    ap.add_argument("--command-every", type=int, default=500, help="1 onCommand aléatoire tous les N cycles (moyenne)")
+    ap.add_argument("--scenario", choices=sorted(SCENARIOS), default="basic",
+                    help="stress : API lente (temps virtuel) avec blocages, groupe de relais G<idx>, découverte par plans")
+    ap.add_argument("--budget", type=float, default=10.0, help="budget de cycle du plugin (s, Mode2)")
+    ap.add_argument("--http", action="store_true", help="passer par un vrai serveur HTTP local (sockets)")
+    ap.add_argument("--debug", action="store_true", help="plugin en Debug (sink de trace actif)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+    scenario = SCENARIOS[args.scenario]
+
+    # une socket / un fichier non refermé échoue le soak (les ResourceWarning de __del__ passent par le hook)
+    warnings.simplefilter("error", ResourceWarning)
+    unraisable = []
+    sys.unraisablehook = lambda u: unraisable.append(f"{u.exc_type.__name__}: {u.exc_value}")
+
+    home = tempfile.mkdtemp(prefix="vmcdf-soak-")
+    discovery = scenario["discovery"]
+    parameters = {
+        # découverte : listes vides, les rôles viennent des plans
+        "Username": "" if discovery else ",".join(map(str, OUTDOOR)),
+        "Password": "" if discovery else ",".join(map(str, NORMAL)),
+        "Mode1": "" if discovery else ",".join(map(str, WET)),
+        "Mode2": f"{args.budget},300,120,0,{discovery}",
+        "Mode3": scenario["mode3"],
+        "Mode4": "",
+        "Mode5": "60,55,75,20,10,5",
+        "Mode6": "62" if args.debug else "0",
+        "HomeFolder": home + os.sep,
+    }
+    install_fake_domoticz(parameters)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import plugin
+
+    clock = VirtualClock()
+    plugin.datetime = clock.datetime_cls()
+    plugin.time = clock.time_module()
+    model = SensorModel(clock, args.seed, scenario["latency"], scenario["hang_every"])
+    rng = random.Random(args.seed + 1)
+
+    server = None
+    if args.http:
+        model.hang_every = 0  # le serveur ne voit pas le timeout client : pas de blocage simulé
+        server = start_http_stub(model)
+        plugin.API_URL = f"http://127.0.0.1:{server.server_address[1]}/json.htm"
+    else:
+        urllib.request.install_opener(urllib.request.build_opener(StubHandler(model)))
+
+    # chemin critique en temps virtuel (latence API simulée) : borne = budget + 1 timeout plancher par appel relais
+    critical = array("d")
+    report = plugin._plugin.report_critical_path
+
+    def report_hook(elapsed):
+        critical.append(elapsed)
+        report(elapsed)
+
+    plugin._plugin.report_critical_path = report_hook
+    relay_calls = 1 if scenario["mode3"].startswith("G") else len(RELAYS)
+    critical_cap = args.budget + plugin.API_MIN_TIMEOUT * 2 * relay_calls  # lecture d'état + commande
+
+    tracemalloc.start()
+    plugin.onStart()
+
+    lat = array("d")
+    base_mem = base_snap = base_p99 = base_fds = None
+    slow_windows = 0
+    failures = []
+    perf = time.perf_counter
+    t_start = perf()
+
+    print(f"{'cycles':>10} {'mem KiB':>10} {'Δmem KiB':>10} {'fds':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'crit s':>7}")
+    for i in range(1, args.cycles + 1):
+        clock.advance(HEARTBEAT)
+        t0 = perf()
+        if rng.randrange(args.command_every) == 0:
+            unit = 7 if rng.random() < 0.1 else 3
+            plugin.onCommand(unit, "Set Level", rng.choice((10, 20, 30)), 0)
+        plugin.onHeartbeat()
+        lat.append(perf() - t0)
+
+        if i % args.window:
+            continue
+
+        lat_sorted = sorted(lat)
+        p50, p99, pmax = (percentile(lat_sorted, 50) * 1000, percentile(lat_sorted, 99) * 1000,
+                          lat_sorted[-1] * 1000)
+        crit = max(critical) if critical else 0.0
+        # mesure mémoire hors buffers de mesure du soak lui-même
+        lat = lat_sorted = None
+        del critical[:]
+        gc.collect()
+        mem, _ = tracemalloc.get_traced_memory()
+        fds = open_fds()
+        lat = array("d")
+        window_no = i // args.window
+
+        if window_no == args.warmup:
+            base_mem, base_p99, base_fds = mem, p99, fds
+            base_snap = tracemalloc.take_snapshot()
+        grow = (mem - base_mem) / 1024 if base_mem is not None else 0.0
+        print(f"{i:>10} {mem / 1024:>10.1f} {grow:>+10.1f} {fds if fds is not None else '-':>5} "
+              f"{p50:>8.3f} {p99:>8.3f} {pmax:>8.3f} {crit:>7.2f}", flush=True)
+
+        if unraisable:
+            failures.append(f"{len(unraisable)} unraisable exception(s), first: {unraisable[0]}")
+            break
+        if crit > critical_cap:
+            failures.append(f"critical path {crit:.2f}s > {critical_cap:.2f}s (budget {args.budget}s) "
+                            f"after {i} cycles")
+            break
+        if base_mem is None or window_no == args.warmup:
+            continue
+        if grow > args.mem_kib:
+            failures.append(f"memory grew {grow:.1f} KiB > {args.mem_kib} KiB after {i} cycles")
+            break
+        if fds is not None and base_fds is not None and fds - base_fds > args.fd_slack:
+            failures.append(f"open file descriptors grew {base_fds} -> {fds} after {i} cycles")
+            break
+        if p99 > args.p99_floor_ms and p99 > base_p99 * args.p99_drift:
+            slow_windows += 1
+            if slow_windows >= args.drift_windows:
+                failures.append(f"p99 {p99:.3f} ms > {args.p99_drift}x reference {base_p99:.3f} ms "
+                                f"for {slow_windows} windows after {i} cycles")
+                break
+        else:
+            slow_windows = 0
+
+    if discovery and not failures:
+        found = (plugin._plugin.outdoor_idxs, plugin._plugin.indoor_idxs, plugin._plugin.hum_idxs)
+        if found != (OUTDOOR, NORMAL, WET):
+            failures.append(f"room plans discovery gave outdoor/normal/wet {found}")
+
+    if failures and base_snap is not None:
+        print("Top allocations since reference snapshot:")
+        for stat in tracemalloc.take_snapshot().compare_to(base_snap, "lineno")[:10]:
+            print(f"  {stat}")
+
+    plugin.onStop()
+    tracemalloc.stop()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+    shutil.rmtree(home, ignore_errors=True)
+
+    print(f"{args.cycles if not failures else i} cycles in {perf() - t_start:.1f}s ({args.scenario}), "
+          f"{_counters['error']} Domoticz.Error, {model.calls} API calls ({model.timeouts} timed out), "
+          f"relays={model.relay}")
+    for f in failures:
+        print(f"FAIL: {f}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests du journal binaire (stdlib) : python3 -m unittest   ou   python3 -m pytest
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import decisionlog as dl
+
+
+class DecisionLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="vmcdf-log-")
+        self.path = os.path.join(self.dir, "decisions.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write(self, log, ts, path=dl.PATH_DTD):
+        log.write(ts, dl.MODE_AUTO, path, True, True, 5.0, 10.0, 7.5, [80.0, 60.0], [12.0, 9.0], [4.5, 1.5])
+
+    def test_round_trip(self):
+        log = dl.DecisionLog(self.path)
+        for ts in (10.0, 30.0):
+            self.write(log, ts)
+        log.close()
+        with dl.DecisionLogReader(self.path) as r:
+            self.assertEqual(len(r), 2)
+            cols = r.columns()
+        self.assertEqual(list(cols["ts"]), [10.0, 30.0])
+        self.assertEqual(list(cols["n_rooms"]), [2.0, 2.0])
+        self.assertEqual(list(cols["rh"][1]), [60.0, 60.0])
+        self.assertTrue(math.isnan(cols["rh"][2][0]))
+
+    def test_partial_record_cut_on_reopen(self):
+        log = dl.DecisionLog(self.path)
+        self.write(log, 10.0)
+        log.close()
+        with open(self.path, "ab") as fh:
+            fh.write(b"\x01\x02\x03\x04")  # crash au milieu d'une écriture
+        log = dl.DecisionLog(self.path)
+        self.write(log, 30.0, dl.PATH_FALLBACK)
+        log.close()
+        with dl.DecisionLogReader(self.path) as r:
+            cols = r.columns()
+        self.assertEqual(list(cols["ts"]), [10.0, 30.0])
+        self.assertEqual(list(cols["path"]), [dl.PATH_DTD, dl.PATH_FALLBACK])
+
+    def test_foreign_header_set_aside(self):
+        with open(self.path, "wb") as fh:
+            fh.write(dl.HEADER.pack(dl.LOG_MAGIC, dl.LOG_VERSION + 1, dl.MAX_ROOMS, dl.RECORD.size) + b"x" * 50)
+        log = dl.DecisionLog(self.path)
+        self.write(log, 10.0)
+        log.close()
+        self.assertEqual(log.set_aside, self.path + ".bad")
+        self.assertTrue(os.path.exists(self.path + ".bad"))
+        with dl.DecisionLogReader(self.path) as r:
+            self.assertEqual(len(r), 1)
+
+    def test_chain_reads_rotated_files_in_order(self):
+        log = dl.DecisionLog(self.path, max_bytes=dl.HEADER.size + 2 * dl.RECORD.size, backups=3)
+        for ts in range(5):
+            self.write(log, float(ts))
+        log.close()
+        with dl.DecisionLogChain(self.path) as chain:
+            self.assertEqual(len(chain), 5)
+            self.assertEqual(list(chain.columns()["ts"]), [0.0, 1.0, 2.0, 3.0, 4.0])
+            self.assertEqual([rec[0] for rec in chain[1:4]], [1.0, 2.0, 3.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests du moteur de règles (stdlib) : python3 -m unittest   ou   python3 -m pytest
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import decisionlog as dl
+import rules
+
+HIGH, LOW, TD_ON, TD_OFF = 75.0, 55.0, 1.0, 0.5
+
+
+def legacy_decision(hum_vals, gaps, Td_ref, last_on):
+    """Logique unifiée ΔTd + High/Low d'origine (plugin 1.0.4), pour comparaison."""
+    if Td_ref is None or gaps is None:
+        if any(v >= HIGH for v in hum_vals):
+            return True
+        if all(v <= LOW for v in hum_vals):
+            return False
+        return last_on
+    n = min(len(hum_vals), len(gaps))
+    if any(hum_vals[i] >= HIGH and gaps[i] >= TD_ON for i in range(n)):
+        return True
+    if all(gaps[i] <= TD_OFF or (gaps[i] >= TD_OFF and hum_vals[i] <= LOW) for i in range(n)):
+        return False
+    return last_on
+
+
+def quarter(rng, lo, hi):
+    # valeurs exactes en float32 : le journal les restitue à l'identique
+    return round(rng.uniform(lo, hi) * 4) / 4
+
+
+class RuleSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = rules.RuleSet(High=HIGH, Low=LOW, td_on=TD_ON, td_off=TD_OFF)
+
+    def test_default_rules_match_legacy_logic(self):
+        rng = random.Random(0)
+        for _ in range(20000):
+            n = rng.randint(0, 4)
+            hum = [quarter(rng, 40, 100) for _ in range(n)]
+            last = rng.random() < 0.5
+            if rng.random() < 0.3:
+                on, off = self.rs.evaluate("fallback", hum)
+                self.assertEqual(self.rs.decide(on, off, last), legacy_decision(hum, None, None, last))
+            else:
+                gaps = [quarter(rng, -3, 5) for _ in range(n)]
+                on, off = self.rs.evaluate("dtd", hum, dTd=gaps, Td_ref=10.0)
+                self.assertEqual(self.rs.decide(on, off, last), legacy_decision(hum, gaps, 10.0, last))
+
+    def test_default_constants(self):
+        self.assertEqual(rules.RuleSet().evaluate("fallback", [80.0]), (True, False))
+
+    def test_missing_value_never_matches(self):
+        self.assertEqual(self.rs.evaluate("fallback", [None, 60.0]), (False, False))
+        self.assertEqual(self.rs.evaluate("dtd", [80.0], dTd=[None]), (False, False))
+
+    def test_rejected_conditions(self):
+        for text in ("on any RH", "on any RH >= 70 and slope", "on any not RH >= 70", "off all RH != 50",
+                     "on any (RH > 5) > 3", "on any RH >= Unknown", "on some RH >= 70", "[other]"):
+            with self.assertRaises(rules.RuleError, msg=text):
+                rules.RuleSet(text)
+
+
+class ReplayTest(unittest.TestCase):
+    """Décisions 'live' (comme BasePlugin.apply_control) écrites au journal puis rejouées à l'identique."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="vmcdf-rules-")
+        self.path = os.path.join(self.dir, "decisions.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_replay_round_trip(self):
+        rs = rules.RuleSet(High=HIGH, Low=LOW, td_on=TD_ON, td_off=TD_OFF)
+        rng = random.Random(1)
+        log = dl.DecisionLog(self.path)
+        expected = []
+        last_on = False
+        for cycle in range(3000):
+            forced = rng.random() < 0.05
+            hum = [quarter(rng, 40, 100) for _ in range(rng.randint(0, 4))]
+            td_rooms = [quarter(rng, 5, 20) for _ in hum]
+            if td_rooms and rng.random() < 0.2:
+                td_rooms.pop()  # une pièce sans Td : n évalué < nb de pièces
+            slopes = [None if rng.random() < 0.1 else quarter(rng, -2, 2) for _ in hum]
+            Td_ref = None if rng.random() < 0.2 else quarter(rng, 5, 15)
+            gaps, n_eval = [], 0
+            if forced:
+                path, target = dl.PATH_FORCED, True
+                expected.append(dl.STATE_NONE)
+            elif not hum:
+                path, target = dl.PATH_NODATA, None
+                expected.append(1 if last_on else 0)
+            elif Td_ref is None or not td_rooms:
+                path, n_eval = dl.PATH_FALLBACK, len(hum)
+                on, off = rs.evaluate("fallback", hum, Td=td_rooms, slope=slopes, Td_ref=Td_ref)
+                target = last_on = rs.decide(on, off, last_on)
+                expected.append(1 if last_on else 0)
+            else:
+                path = dl.PATH_DTD
+                n = n_eval = min(len(hum), len(td_rooms))
+                gaps = [td_rooms[i] - Td_ref for i in range(n)]
+                on, off = rs.evaluate("dtd", hum[:n], Td=td_rooms[:n], dTd=gaps, slope=slopes[:n], Td_ref=Td_ref)
+                target = last_on = rs.decide(on, off, last_on)
+                expected.append(1 if last_on else 0)
+            log.write(cycle * 20.0, dl.MODE_FORCED if forced else dl.MODE_AUTO, path, target, target,
+                      None, None, Td_ref, hum, td_rooms, gaps, slopes, n_eval)
+        log.close()
+
+        with dl.DecisionLogReader(self.path) as reader:
+            replayed = list(rs.replay(reader.columns()))
+        self.assertEqual(len(replayed), len(expected))
+        diverged = [i for i, (a, b) in enumerate(zip(replayed, expected)) if a != b]
+        self.assertEqual(diverged[:10], [], "replay diverges from live at these records")
+
+
+if __name__ == "__main__":
+    unittest.main()